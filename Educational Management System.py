@@ -1,56 +1,139 @@
+import argparse
+import array
+import asyncio
+import atexit
+import bisect
+import builtins
+import codecs
+import collections
+import concurrent.futures
+import contextlib
+import cProfile
+import csv
+import datetime
+import functools
+import heapq
 import json
 import hashlib
+import importlib
+import inspect
+import itertools
+import math
+import mmap
+import os
+import pstats
 import re
+import secrets
+import signal
+import sqlite3
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import traceback
+import warnings
+
+try:
+    import numpy
+except ImportError:  # The gradebook falls back to the array module
+    numpy = None
+
+try:
+    import resource
+except ImportError:  # Windows: autograded solutions run without file size limits
+    resource = None
+
+try:
+    import pwd
+except ImportError:  # Windows: test cases can only run unsandboxed
+    pwd = None
+
+JOURNAL_BATCH_SIZE = 32  # Records appended between two fsyncs of the journal
+COURSE_CACHE_SIZE = 64   # Lazily loaded courses kept in memory before the coldest is evicted
+BULK_BATCH_SIZE = 1000   # Imported rows made durable together
+PAGE_SIZE = 20           # Rows shown at a time by the listings
+MAX_PAGE_SIZE = 1000     # Largest page_size the query operation accepts
+FETCH_SIZE = 1000        # Rows fetched from SQLite at a time when a report is streamed
+SESSION_TTL = 8 * 60 * 60  # Seconds a session token stays valid after sign-in
+SESSION_CAPACITY = 10000   # Session tokens kept before the least recently used is dropped
+BLOB_CHUNK_SIZE = 64 * 1024  # Bytes read at a time when a submission body is streamed
+SHINGLE_SIZE = 5             # Characters per shingle when solutions are compared
+MINHASH_BINS = 128           # Values in a MinHash signature
+MINHASH_BANDS = 32           # LSH bands; solutions agreeing on every value of one band are compared
+SIGNATURE_CACHE_SIZE = 10000  # MinHash signatures kept by blob digest
+AUTOGRADE_TIMEOUT = 5        # Seconds one solution may run before it is given 0
+AUTOGRADE_CHUNK_SIZE = 8     # Solutions sent to a grading process at a time
+AUTOGRADE_BATCH_SIZE = 100   # Grades written back and made durable together
+LATENCY_BUCKETS = 32         # Power-of-two microsecond buckets in a latency histogram, the last one open-ended
+PROFILE_ENV = 'EMS_PROFILE'  # Environment variable that turns instrumentation on, like --profile
+PROFILE_TOP = 25             # Functions listed when a profiled menu action ends
+DEADLINE_FORMATS = ('%Y-%m-%d %H:%M', '%Y-%m-%dT%H:%M', '%Y-%m-%d %H:%M:%S', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d')
+EMAIL_PATTERN = re.compile(r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$')
 
 class User:
-    def __init__(self, user_id, username, password, full_name, email):
+    __slots__ = ('user_id', 'username', 'password', 'full_name', 'email')
+
+    def __init__(self, user_id, username, password, full_name, email, hashed=False):
         self.user_id = user_id
         self.username = username
-        self.password = self.encrypt_password(password)
+        self.password = password if hashed else self.encrypt_password(password)
         self.full_name = full_name
         self.email = email
 
-    def encrypt_password(self, password):
+    @staticmethod
+    def encrypt_password(password):
         return hashlib.sha256(password.encode()).hexdigest()
 
     def sign_in(self, username, password):
         return self.username == username and self.password == self.encrypt_password(password)
 
-    def log_out(self):
+    def check_password(self, hashed_password):
+        return self.password == hashed_password
+
+    def log_out(self, token=None):
+        if token is not None:
+            sessions.revoke(token)
         print("Logged out successfully.")
 
     def to_dict(self):
-        return self.__dict__
+        return {
+            'user_id': self.user_id,
+            'username': self.username,
+            'password': self.password,
+            'full_name': self.full_name,
+            'email': self.email
+        }
 
     @classmethod
     def from_dict(cls, user_dict):
-        user = cls(user_dict['user_id'], user_dict['username'], user_dict['password'], user_dict['full_name'], user_dict['email'])
-        user.password = user_dict['password']  # Directly assigning encrypted password
-        return user
+        # The stored password is already encrypted
+        return cls(user_dict['user_id'], user_dict['username'], user_dict['password'], user_dict['full_name'], user_dict['email'],
+                   hashed=True)
 
     @staticmethod
     def is_valid_email(email):
-        regex = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
-        return re.match(regex, email) is not None
+        return EMAIL_PATTERN.match(email) is not None
 
 class Doctor(User):
-    def __init__(self, user_id, username, password, full_name, email):
-        super().__init__(user_id, username, password, full_name, email)
-        self.courses_created = []
+    __slots__ = ()
+
+    @property
+    def courses_created(self):
+        return catalog.courses_of_doctor(self)
 
     def create_course(self, course_name, course_code):
         course = Course(course_name, course_code, self)
-        self.courses_created.append(course)
+        catalog.add_course(course)
+        record('create_course', doctor_id=self.user_id, course_name=course_name, course_code=course_code)
         return course
 
     def list_courses(self):
         return self.courses_created
 
     def view_course(self, course_code):
-        for course in self.courses_created:
-            if course.course_code == course_code:
-                return course
-        return None
+        return catalog.doctor_course(self, course_code)
 
     def to_dict(self):
         data = super().to_dict()
@@ -60,27 +143,41 @@ class Doctor(User):
     @classmethod
     def from_dict(cls, user_dict):
         doctor = super().from_dict(user_dict)
-        doctor.courses_created = [Course.from_dict(course) for course in user_dict['courses_created']]
+        for course_dict in user_dict['courses_created']:
+            course = Course.from_dict(course_dict)
+            course.provided_by = doctor
+            catalog.add_course(course)
         return doctor
 
 
 class Student(User):
-    def __init__(self, user_id, username, password, full_name, email):
-        super().__init__(user_id, username, password, full_name, email)
-        self.courses_registered = []
+    __slots__ = ()
+
+    @property
+    def courses_registered(self):
+        return catalog.courses_of_student(self)
 
     def register_course(self, course):
-        self.courses_registered.append(course)
-        course.add_student(self)
+        catalog.register(self, course)
+        record('register_course', student_id=self.user_id, course_code=course.course_code)
+
+    def unregister_course(self, course):
+        catalog.unregister(self, course)
+        record('unregister_course', student_id=self.user_id, course_code=course.course_code)
 
     def list_courses(self):
         return self.courses_registered
 
     def view_course(self, course_code):
-        for course in self.courses_registered:
-            if course.course_code == course_code:
-                return course
-        return None
+        return catalog.student_course(self, course_code)
+
+    def upcoming_deadlines(self, limit=10, now=None):
+        # The next (due, assignment) pairs across the registered courses, soonest first: each course's
+        # deadlines are already sorted, so they are merged lazily and only limit of them are taken
+        now = time.time() if now is None else now
+        merged = heapq.merge(*(course.upcoming_deadlines(now) for course in catalog.courses_of_student(self)),
+                             key=lambda entry: entry[0])
+        return list(itertools.islice(merged, limit))
 
     def view_grades(self):
         grades_report = {}
@@ -94,161 +191,2878 @@ class Student(User):
         data['courses_registered'] = [course.course_code for course in self.courses_registered]
         return data
 
-    @classmethod
-    def from_dict(cls, user_dict):
-        student = super().from_dict(user_dict)
-        student.courses_registered = user_dict['courses_registered']
-        return student
-
 
 class Course:
-    def __init__(self, course_name, course_code, provided_by):
-        self.course_name = course_name
-        self.course_code = course_code
+    __slots__ = ('course_name', 'course_code', 'provided_by', 'registered_students', 'loader', 'modified',
+                 '_assignments', '_gradebook', 'student_totals', 'deadlines')
+
+    def __init__(self, course_name, course_code, provided_by, loader=None):
+        # Codes and names are repeated across enrollments, journal records and reports
+        self.course_name = sys.intern(course_name)
+        self.course_code = sys.intern(course_code)
         self.provided_by = provided_by
-        self.registered_students = []
-        self.assignments = []
+        self.registered_students = {}  # user_id -> Student
+        self.loader = loader           # Fetches the assignments of a lazily loaded course from storage
+        self.modified = False          # Changed since it was last written to storage, so it cannot be evicted
+        self._assignments = [] if loader is None else None
+        self._gradebook = None
+        self.student_totals = {}  # user_id -> [total grade, submissions], kept up to date on every change
+        self.deadlines = []       # (due, assignment index) of the assignments with a parsed deadline, sorted
+
+    def gradebook(self):
+        # Built on first use, patched cell by cell on submissions and grades, and dropped when the
+        # assignments or students change
+        if self._gradebook is None:
+            self._gradebook = Gradebook(self)
+        return self._gradebook
+
+    def update_gradebook(self, student_id, assignment, grade):
+        if self._gradebook is not None and not self._gradebook.update(student_id, assignment.index, grade):
+            self._gradebook = None  # No row for the student yet
+
+    @property
+    def assignments(self):
+        if self.loader is not None:
+            with catalog.lock:
+                if self._assignments is None:
+                    self._assignments = []
+                    for assignment in self.loader(self):
+                        self.attach_assignment(assignment)
+                catalog.touch(self)
+        return self._assignments
+
+    def mark_modified(self):
+        self.modified = True
+
+    def unload(self):
+        if self.loader is not None and not self.modified:
+            self._assignments = None
+            self._gradebook = None
+            self.student_totals = {}
+            self.deadlines = []
 
     def add_student(self, student):
-        self.registered_students.append(student)
+        self.registered_students[student.user_id] = student
+        self._gradebook = None
 
     def remove_student(self, student):
-        self.registered_students.remove(student)
+        self.registered_students.pop(student.user_id, None)
+        self._gradebook = None
 
     def add_assignment(self, assignment_title, description, deadline):
         assignment = Assignment(assignment_title, description, deadline)
-        self.assignments.append(assignment)
+        self.assignments  # A lazily loaded course is loaded first, so the new assignment is numbered after its own
+        self.attach_assignment(assignment)
+        self._gradebook = None
+        self.mark_modified()
+        record('add_assignment', course_code=self.course_code, assignment_title=assignment_title,
+               description=description, deadline=deadline)
         return assignment
 
+    def attach_assignment(self, assignment):
+        assignment.course = self
+        assignment.index = len(self._assignments)
+        self._assignments.append(assignment)
+        if assignment.due is not None:
+            bisect.insort(self.deadlines, (assignment.due, assignment.index))
+        for student_id, solution in assignment.solutions.items():
+            assignment.count_grade(solution.grade, 1)
+            assignment.count_timing(solution.submitted_at, 1)
+            self.update_totals(student_id, solution.grade or 0, 1)
+
+    def update_totals(self, student_id, grade_delta, submissions_delta):
+        totals = self.student_totals.get(student_id)
+        if totals is None:
+            totals = self.student_totals[student_id] = [0, 0]
+        totals[0] += grade_delta
+        totals[1] += submissions_delta
+
     def list_assignments(self):
         return self.assignments
 
+    def upcoming_deadlines(self, now):
+        # (due, assignment) for the deadlines after now, soonest first
+        assignments = self.assignments  # Loads a lazily loaded course, which builds its deadlines
+        deadlines = self.deadlines
+        for i in range(bisect.bisect_right(deadlines, (now, math.inf)), len(deadlines)):
+            due, index = deadlines[i]
+            yield due, assignments[index]
+
     def get_student_grade(self, student):
-        total_grade = 0
-        total_possible = 0
-        for assignment in self.assignments:
-            grade = assignment.get_student_grade(student)
-            if grade is not None:
-                total_grade += int(grade['grade']) if grade['grade'] else 0
-                total_possible += 100  # Assuming each assignment is out of 100
-        return total_grade, total_possible
+        self.assignments  # Loads a lazily loaded course, which builds its totals
+        total_grade, submissions = self.student_totals.get(student.user_id, (0, 0))
+        return total_grade, submissions * 100  # Assuming each assignment is out of 100
 
     def to_dict(self):
         return {
             'course_name': self.course_name,
             'course_code': self.course_code,
             'provided_by': self.provided_by.user_id,
-            'registered_students': [student.user_id for student in self.registered_students],
+            'registered_students': list(self.registered_students),
             'assignments': [assignment.to_dict() for assignment in self.assignments]
         }
 
     @classmethod
     def from_dict(cls, course_dict):
+        # registered_students is rebuilt from the students' side by load_data
         course = cls(course_dict['course_name'], course_dict['course_code'], course_dict['provided_by'])
-        course.registered_students = course_dict['registered_students']
-        course.assignments = [Assignment.from_dict(assignment) for assignment in course_dict['assignments']]
+        for assignment_dict in course_dict['assignments']:
+            course.attach_assignment(Assignment.from_dict(assignment_dict))
         return course
 
 
 class Assignment:
+    __slots__ = ('assignment_title', 'description', 'deadline', 'solutions', 'graded_count', 'grade_sum',
+                 'grade_sum_squares', 'course', 'index', 'similarity', 'test_spec', 'due', 'on_time_count',
+                 'late_count')
+
     def __init__(self, assignment_title, description, deadline):
-        self.assignment_title = assignment_title
+        self.assignment_title = sys.intern(assignment_title)
         self.description = description
-        self.deadline = deadline
-        self.solutions = {}
+        self.deadline = sys.intern(deadline)
+        self.due = parse_deadline(deadline)  # Timestamp of the deadline, or None if it is not a date
+        self.solutions = {}  # user_id -> Solution
+        self.graded_count = 0  # Running statistics over the graded solutions
+        self.grade_sum = 0
+        self.grade_sum_squares = 0
+        self.course = None  # Set when the assignment is attached to a course
+        self.index = None
+        self.similarity = None  # SimilarityIndex, built the first time similar solutions are listed
+        self.test_spec = None   # How autograde checks a solution, see validate_test_spec
+        self.on_time_count = 0  # Solutions submitted by the deadline and after it, among the timestamped ones
+        self.late_count = 0
 
     def submit_solution(self, student, submission_content):
-        self.solutions[student.user_id] = {'content': submission_content, 'grade': None, 'comments': None}
+        # The body goes to the blob store; the solution only keeps its digest and size
+        digest, size = blobs.put(submission_content)
+        signatures.add(digest, submission_content)
+        self.submit_blob(student, digest, size, time.time())
+
+    def submit_blob(self, student, digest, size, submitted_at=None):
+        # A resubmission replaces the previous solution and drops its grade
+        previous = self.solutions.get(student.user_id)
+        if previous is not None:
+            self.count_grade(previous.grade, -1)
+            self.count_timing(previous.submitted_at, -1)
+            self.course.update_totals(student.user_id, -(previous.grade or 0), -1)
+        self.solutions[student.user_id] = Solution(digest, size, submitted_at=submitted_at)
+        self.count_timing(submitted_at, 1)
+        if self.similarity is not None:
+            self.similarity.add(student.user_id, digest)
+        self.course.update_totals(student.user_id, 0, 1)
+        self.course.update_gradebook(student.user_id, self, None)
+        self.course.mark_modified()
+        record('submit_solution', course_code=self.course.course_code, assignment=self.index,
+               student_id=student.user_id, digest=digest, size=size, submitted_at=submitted_at)
 
     def grade_solution(self, student, grade, comments):
+        grade = validate_grade(grade)
         if student.user_id in self.solutions:
-            self.solutions[student.user_id]['grade'] = grade
-            self.solutions[student.user_id]['comments'] = comments
+            solution = self.solutions[student.user_id]
+            self.count_grade(solution.grade, -1)
+            self.count_grade(grade, 1)
+            self.course.update_totals(student.user_id, (grade or 0) - (solution.grade or 0), 0)
+            solution.grade = grade
+            solution.comments = None if comments is None else sys.intern(comments)
+            self.course.update_gradebook(student.user_id, self, grade)
+            self.course.mark_modified()
+            record('grade_solution', course_code=self.course.course_code, assignment=self.index,
+                   student_id=student.user_id, grade=grade, comments=comments)
 
     def get_student_grade(self, student):
         if student.user_id in self.solutions:
             return self.solutions[student.user_id]
         return None
 
+    def count_grade(self, grade, sign):
+        if grade is not None:
+            self.graded_count += sign
+            self.grade_sum += sign * grade
+            self.grade_sum_squares += sign * grade * grade
+
+    def count_timing(self, submitted_at, sign):
+        if submitted_at is not None and self.due is not None:
+            if submitted_at > self.due:
+                self.late_count += sign
+            else:
+                self.on_time_count += sign
+
+    def is_late(self, solution):
+        return solution.submitted_at is not None and self.due is not None and solution.submitted_at > self.due
+
+    def grade_stats(self):
+        # (graded solutions, mean, population standard deviation) from the running sums
+        if not self.graded_count:
+            return 0, None, None
+        mean = self.grade_sum / self.graded_count
+        variance = max(self.grade_sum_squares / self.graded_count - mean * mean, 0)
+        return self.graded_count, mean, variance ** 0.5
+
+    def get_solution_content(self, student_id):
+        return blobs.read(self.solutions[student_id].digest)
+
+    def set_test_spec(self, test_spec):
+        self.test_spec = validate_test_spec(test_spec)
+        self.course.mark_modified()
+        record('set_test_spec', course_code=self.course.course_code, assignment=self.index, test_spec=test_spec)
+
+    def similar_solutions(self, threshold):
+        # (similarity, student_id, other_student_id) for every pair of solutions at least threshold (0 to 1) alike
+        if not 0 < threshold <= 1:
+            raise ValueError("Similarity threshold must be between 0 and 100%.")
+        if self.similarity is None:
+            self.similarity = SimilarityIndex()
+            for student_id, solution in self.solutions.items():
+                self.similarity.add(student_id, solution.digest)
+        return self.similarity.pairs(threshold)
+
     def to_dict(self):
         return {
             'assignment_title': self.assignment_title,
             'description': self.description,
             'deadline': self.deadline,
-            'solutions': self.solutions
+            'solutions': {student_id: {'digest': solution.digest, 'size': solution.size, 'grade': solution.grade,
+                                       'comments': solution.comments, 'submitted_at': solution.submitted_at}
+                          for student_id, solution in self.solutions.items()},
+            'test_spec': self.test_spec
         }
 
     @classmethod
     def from_dict(cls, assignment_dict):
         assignment = cls(assignment_dict['assignment_title'], assignment_dict['description'], assignment_dict['deadline'])
-        assignment.solutions = assignment_dict['solutions']
+        # JSON object keys are strings; solutions are keyed by integer user_id
+        assignment.solutions = {int(student_id): Solution(*solution_blob(solution), parse_grade(solution['grade']),
+                                                          solution['comments'], solution.get('submitted_at'))
+                                for student_id, solution in assignment_dict['solutions'].items()}
+        assignment.test_spec = assignment_dict.get('test_spec')
         return assignment
 
 
-def save_data(users, filename='ems_data.json'):
-    data = {
-        'users': [user.to_dict() for user in users.values()]
-    }
-    with open(filename, 'w') as f:
-        json.dump(data, f)
+class Solution:
+    __slots__ = ('digest', 'size', 'grade', 'comments', 'submitted_at')
 
+    def __init__(self, digest, size, grade=None, comments=None, submitted_at=None):
+        self.digest = sys.intern(digest)  # SHA-256 of the body in the blob store
+        self.size = size                  # Length of the body in bytes
+        self.grade = grade
+        self.comments = None if comments is None else sys.intern(comments)
+        self.submitted_at = submitted_at  # Timestamp, or None for solutions saved before submissions were timed
 
-def load_data(filename='ems_data.json'):
+
+def solution_blob(solution_dict):
+    # Snapshots and journals written before the blob store carry the body itself
+    if 'digest' in solution_dict:
+        return solution_dict['digest'], solution_dict['size']
+    return blobs.put(solution_dict['content'])
+
+
+def parse_deadline(deadline):
+    # Deadlines are free text; the ones in a DEADLINE_FORMATS form get a local timestamp, dates at the end of the day
+    for deadline_format in DEADLINE_FORMATS:
+        try:
+            parsed = datetime.datetime.strptime(deadline.strip(), deadline_format)
+        except ValueError:
+            continue
+        if deadline_format == '%Y-%m-%d':
+            parsed = parsed.replace(hour=23, minute=59, second=59)
+        return parsed.timestamp()
+    return None
+
+
+def validate_deadline(deadline):
+    # New assignments need a deadline that parses; older free-text ones are still loaded as they are
+    if parse_deadline(deadline) is None:
+        raise ValueError("Deadline must be a date like 2026-12-01 or 2026-12-01 23:59.")
+    return deadline
+
+
+def format_time(timestamp):
+    return time.strftime('%Y-%m-%d %H:%M', time.localtime(timestamp))
+
+
+def validate_test_spec(test_spec):
+    # One of {'answer': text}, compared with whitespace normalized; {'cases': [{'input': text, 'output': text}, ...]},
+    # running the solution as a Python program on each input; or {'grader': 'module:function'}, called with the
+    # solution's content and returning a grade or (grade, comments). None removes the spec.
+    if test_spec is None:
+        return None
+    if isinstance(test_spec, dict) and len(test_spec) == 1:
+        kind, value = next(iter(test_spec.items()))
+        if kind == 'answer' and isinstance(value, str):
+            return test_spec
+        if kind == 'cases' and isinstance(value, list) and value and all(
+                isinstance(case, dict) and isinstance(case.get('input', ''), str) and isinstance(case.get('output'), str)
+                for case in value):
+            return test_spec
+        if kind == 'grader' and isinstance(value, str) and value.count(':') == 1:
+            return test_spec
+    raise ValueError("A test spec needs an 'answer', a list of 'cases' with an 'input' and an 'output', "
+                     "or a 'grader' given as module:function.")
+
+
+def validate_grade(grade):
+    # Grades are numbers from 0 to 100, given as numbers or typed at the prompt; None clears the grade
+    if grade is None:
+        return None
     try:
-        with open(filename, 'r') as f:
-            data = json.load(f)
-            users = {}
-            for user_data in data['users']:
-                if 'courses_created' in user_data:
-                    user = Doctor.from_dict(user_data)
-                elif 'courses_registered' in user_data:
-                    user = Student.from_dict(user_data)
+        value = float(grade)
+    except (TypeError, ValueError):
+        raise ValueError("Grade must be a number between 0 and 100.")
+    if not 0 <= value <= 100:
+        raise ValueError("Grade must be a number between 0 and 100.")
+    return int(value) if value.is_integer() else value
+
+
+def parse_grade(grade):
+    # Grades saved before they were validated were free text; anything that is not a valid grade counts as ungraded
+    try:
+        return validate_grade(None if grade == '' else grade)
+    except ValueError:
+        return None
+
+
+def percentile(sorted_values, q):
+    # Linear interpolation between closest ranks, like numpy.percentile
+    position = (len(sorted_values) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+# Students x assignments grade matrix of a course, stored row-major in flat
+# arrays (NumPy when available, the array module otherwise) with masks for
+# submitted and graded cells. Every statistic is computed over the matrix in a
+# single pass instead of walking the course's solutions, and a submission or
+# grade only rewrites its own cell.
+class Gradebook:
+    def __init__(self, course, percentiles=(25, 50, 75)):
+        assignments = course.assignments
+        self.assignment_titles = [assignment.assignment_title for assignment in assignments]
+        self.percentiles = percentiles
+        student_ids = list(course.registered_students)
+        rows = {student_id: row for row, student_id in enumerate(student_ids)}
+        for assignment in assignments:
+            for student_id in assignment.solutions:
+                if student_id not in rows:  # Submitted before unregistering
+                    rows[student_id] = len(student_ids)
+                    student_ids.append(student_id)
+        self.student_ids = student_ids
+        self.rows = rows
+
+        n_students, n_assignments = len(student_ids), len(assignments)
+        grades = array.array('d', bytes(8 * n_students * n_assignments))
+        submitted = array.array('b', bytes(n_students * n_assignments))
+        graded = array.array('b', bytes(n_students * n_assignments))
+        for column, assignment in enumerate(assignments):
+            for student_id, solution in assignment.solutions.items():
+                cell = rows[student_id] * n_assignments + column
+                submitted[cell] = 1
+                grade = solution.grade
+                if grade is not None:
+                    grades[cell] = grade
+                    graded[cell] = 1
+
+        self.shape = (n_students, n_assignments)
+        if numpy is not None:
+            self.grades = numpy.frombuffer(grades, dtype=numpy.float64).reshape(self.shape)
+            self.submitted = numpy.frombuffer(submitted, dtype=numpy.int8).reshape(self.shape).astype(bool)
+            self.graded = numpy.frombuffer(graded, dtype=numpy.int8).reshape(self.shape).astype(bool)
+        else:
+            self.grades, self.submitted, self.graded = grades, submitted, graded
+
+    def update(self, student_id, column, grade):
+        # Marks the student's solution to the assignment submitted, with its grade or ungraded;
+        # False if the student has no row
+        row = self.rows.get(student_id)
+        if row is None:
+            return False
+        if numpy is not None:
+            cell = (row, column)
+        else:
+            cell = row * self.shape[1] + column
+        self.grades[cell] = 0 if grade is None else grade
+        self.submitted[cell] = True
+        self.graded[cell] = grade is not None
+        return True
+
+    def column(self, column):
+        # Graded values of one assignment (array fallback only)
+        n_students, n_assignments = self.shape
+        return [self.grades[cell] for cell in range(column, n_students * n_assignments, n_assignments) if self.graded[cell]]
+
+    def student_totals(self):
+        # (student_id, total grade, total possible) per student, like Course.get_student_grade
+        if numpy is not None:
+            totals = self.grades.sum(axis=1)
+            possible = self.submitted.sum(axis=1) * 100
+            return list(zip(self.student_ids, totals.tolist(), possible.tolist()))
+        n_assignments = self.shape[1]
+        return [(student_id, sum(self.grades[row * n_assignments:(row + 1) * n_assignments]),
+                 sum(self.submitted[row * n_assignments:(row + 1) * n_assignments]) * 100)
+                for row, student_id in enumerate(self.student_ids)]
+
+    def assignment_stats(self):
+        # Per assignment: title, submissions, graded, mean, stddev and the requested percentiles
+        stats = []
+        if numpy is not None:
+            counts = self.graded.sum(axis=0)
+            submissions = self.submitted.sum(axis=0)
+            masked = numpy.where(self.graded, self.grades, numpy.nan)
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore', RuntimeWarning)  # All-NaN columns of ungraded assignments
+                means = numpy.nanmean(masked, axis=0)
+                stddevs = numpy.nanstd(masked, axis=0)
+                points = numpy.nanpercentile(masked, self.percentiles, axis=0) if self.shape[0] else None
+            for column, title in enumerate(self.assignment_titles):
+                if counts[column]:
+                    values = {q: float(points[i][column]) for i, q in enumerate(self.percentiles)}
+                    stats.append((title, int(submissions[column]), int(counts[column]), float(means[column]),
+                                  float(stddevs[column]), values))
                 else:
-                    user = User.from_dict(user_data)
-                users[user.user_id] = user
-            return users
-    except FileNotFoundError:
-        return {}
+                    stats.append((title, int(submissions[column]), 0, None, None, {}))
+            return stats
 
+        n_students, n_assignments = self.shape
+        for column, title in enumerate(self.assignment_titles):
+            values = sorted(self.column(column))
+            submissions = sum(self.submitted[column:n_students * n_assignments:n_assignments])
+            if values:
+                mean = sum(values) / len(values)
+                stddev = (sum((value - mean) ** 2 for value in values) / len(values)) ** 0.5
+                stats.append((title, submissions, len(values), mean, stddev,
+                              {q: percentile(values, q) for q in self.percentiles}))
+            else:
+                stats.append((title, submissions, 0, None, None, {}))
+        return stats
 
-def main():
-    users = load_data()
-    current_user = None
-    courses = {}  # Dictionary to store all courses by course code
+    def histogram(self, column=None, bins=10):
+        # Counts of graded values in equal-width bins over 0..100, for one assignment or the whole course
+        if numpy is not None:
+            values = self.grades[self.graded] if column is None else self.grades[:, column][self.graded[:, column]]
+            counts, _ = numpy.histogram(values, bins=bins, range=(0, 100))
+            return counts.tolist()
+        if column is None:
+            values = [grade for grade, graded in zip(self.grades, self.graded) if graded]
+        else:
+            values = self.column(column)
+        counts = [0] * bins
+        for value in values:
+            if 0 <= value <= 100:
+                counts[min(int(value * bins / 100), bins - 1)] += 1
+        return counts
+
+    def rank(self, student):
+        # 1-based competition rank of the student's total grade, or None if not in the course
+        row = self.rows.get(student.user_id)
+        if row is None:
+            return None
+        if numpy is not None:
+            totals = self.grades.sum(axis=1)
+            return int((totals > totals[row]).sum()) + 1
+        totals = [total for _, total, _ in self.student_totals()]
+        return sum(1 for total in totals if total > totals[row]) + 1
+
+    def ranking(self):
+        # (rank, student_id, total grade, total possible) for every student, best total first
+        ranked = sorted(self.student_totals(), key=lambda row: row[1], reverse=True)
+        ranking = []
+        for position, (student_id, total_grade, total_possible) in enumerate(ranked, 1):
+            if position == 1 or total_grade < ranked[position - 2][1]:
+                rank = position
+            ranking.append((rank, student_id, total_grade, total_possible))
+        return ranking
+
+
+class CourseCatalog:
+    def __init__(self, cache_size=COURSE_CACHE_SIZE):
+        self.courses = {}      # course_code -> Course
+        self.by_doctor = {}    # doctor user_id -> {course_code: Course}
+        self.by_student = {}   # student user_id -> {course_code: Course}
+        self.cache_size = cache_size
+        self.loaded = collections.OrderedDict()  # Lazily loaded courses in memory, coldest first
+        self.in_use = set()    # Codes of courses an operation is running on, never evicted
+        self.lock = threading.RLock()  # Guards the indexes and the cache when the service runs operations in threads
+
+    def clear(self):
+        self.courses.clear()
+        self.by_doctor.clear()
+        self.by_student.clear()
+        self.loaded.clear()
+
+    def touch(self, course):
+        with self.lock:
+            if course.course_code in self.loaded:
+                self.loaded.move_to_end(course.course_code)
+                return
+            self.loaded[course.course_code] = course
+            excess = len(self.loaded) - self.cache_size
+            if excess > 0:
+                for cold in [cold for cold in self.loaded.values() if cold.course_code not in self.in_use][:excess]:
+                    del self.loaded[cold.course_code]
+                    cold.unload()
+
+    def add_course(self, course):
+        with self.lock:
+            if course.course_code in self.courses:
+                raise ValueError(f"Course code '{course.course_code}' already exists.")
+            self.courses[course.course_code] = course
+            self.by_doctor.setdefault(course.provided_by.user_id, {})[course.course_code] = course
+
+    def get(self, course_code):
+        return self.courses.get(course_code)
+
+    def courses_of_doctor(self, doctor):
+        return list(self.by_doctor.get(doctor.user_id, {}).values())
+
+    def doctor_course(self, doctor, course_code):
+        return self.by_doctor.get(doctor.user_id, {}).get(course_code)
+
+    def courses_of_student(self, student):
+        return list(self.by_student.get(student.user_id, {}).values())
+
+    def student_course(self, student, course_code):
+        return self.by_student.get(student.user_id, {}).get(course_code)
+
+    def is_registered(self, student, course_code):
+        return course_code in self.by_student.get(student.user_id, {})
+
+    def register(self, student, course):
+        with self.lock:
+            registered = self.by_student.setdefault(student.user_id, {})
+            if course.course_code in registered:
+                raise ValueError(f"Already registered in course '{course.course_code}'.")
+            registered[course.course_code] = course
+            course.add_student(student)
+
+    def unregister(self, student, course):
+        with self.lock:
+            registered = self.by_student.get(student.user_id, {})
+            if registered.pop(course.course_code, None) is not None:
+                course.remove_student(student)
+
+    def available_courses(self, student):
+        registered = self.by_student.get(student.user_id, {})
+        return [course for course_code, course in self.courses.items() if course_code not in registered]
+
+
+catalog = CourseCatalog()
+
+
+class UserDirectory:
+    def __init__(self):
+        self.users = {}         # user_id -> User
+        self.by_username = {}   # username -> User
+        self.by_email = {}      # email -> User
+        self.journal_seq = 0    # Last journal record reflected in this directory
+        self.next_user_id = 1   # Never decreases, so IDs are not reused once handed out
+
+    def add(self, user):
+        if user.username in self.by_username:
+            raise ValueError(f"Username '{user.username}' is already taken.")
+        if user.email in self.by_email:
+            raise ValueError(f"Email '{user.email}' is already registered.")
+        self.users[user.user_id] = user
+        self.by_username[user.username] = user
+        self.by_email[user.email] = user
+        self.next_user_id = max(self.next_user_id, user.user_id + 1)
+        record('sign_up', user=user.to_dict())
+
+    def load(self, user):
+        # A user from a data file, which may predate the checks in add(): a repeated username or email is
+        # reported and keeps reaching the first user that has it, so the file still loads
+        self.users[user.user_id] = user
+        for index, key, field in ((self.by_username, user.username, 'Username'), (self.by_email, user.email, 'Email')):
+            first = index.setdefault(key, user)
+            if first is not user:
+                print(f"Warning: {field} '{key}' of user {user.user_id} is already used by user {first.user_id}; "
+                      f"it only finds user {first.user_id}.", file=sys.stderr)
+        self.next_user_id = max(self.next_user_id, user.user_id + 1)
+
+    def find_by_username(self, username):
+        return self.by_username.get(username)
+
+    def find_by_email(self, email):
+        return self.by_email.get(email)
+
+    def authenticate(self, username, password):
+        # One dictionary lookup and a single hash, regardless of the number of accounts
+        user = self.by_username.get(username)
+        if user is not None and user.check_password(User.encrypt_password(password)):
+            return user
+        return None
+
+    def values(self):
+        return self.users.values()
+
+    def items(self):
+        return self.users.items()
+
+    def get(self, user_id, default=None):
+        return self.users.get(user_id, default)
+
+    def __getitem__(self, user_id):
+        return self.users[user_id]
+
+    def __contains__(self, user_id):
+        return user_id in self.users
+
+    def __len__(self):
+        return len(self.users)
+
+    def __iter__(self):
+        return iter(self.users)
+
+
+def sync_directory(directory):
+    # Makes the names created or renamed in the directory durable, where directories can be opened
+    if not hasattr(os, 'O_DIRECTORY'):
+        return
+    fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def make_directories(directory, sync=True):
+    # Like os.makedirs, but every directory it creates is fsynced into its parent
+    directory = os.path.abspath(directory)
+    if os.path.isdir(directory):
+        return
+    parent = os.path.dirname(directory)
+    make_directories(parent, sync)
+    try:
+        os.mkdir(directory)
+    except FileExistsError:
+        return
+    if sync:
+        sync_directory(parent)
+
+
+# Content-addressed store for submission bodies. Each distinct body is one file
+# named by its SHA-256 under a two-character fan-out directory, written once and
+# never changed, so identical submissions are stored a single time. Bodies are
+# read through a memory map or streamed in chunks, never kept in the model.
+class BlobStore:
+    def __init__(self, directory=None):
+        self.directory = directory
+        self.unsynced = set()  # Paths of blobs written with sync=False, fsynced together by sync()
+
+    def open(self, directory):
+        self.directory = directory
+
+    def path(self, digest):
+        return os.path.join(self.directory, digest[:2], digest[2:])
+
+    def put(self, content, sync=True):
+        # sync=False defers the fsyncs to sync(), for callers that write many blobs at once
+        data = content.encode('utf-8')
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.path(digest)
+        if not os.path.exists(path):
+            # Written under a unique name and renamed, so concurrent writers and readers never see a partial body
+            # and fsynced with its directory, so a digest that was handed out names a blob that survives a crash
+            directory = os.path.dirname(path)
+            make_directories(directory, sync)
+            fd, temp_filename = tempfile.mkstemp(dir=directory, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+                if sync:
+                    f.flush()
+                    os.fsync(f.fileno())
+            os.chmod(temp_filename, 0o444)  # Never changed once written
+            os.replace(temp_filename, path)
+            if sync:
+                sync_directory(directory)
+            else:
+                self.unsynced.add(path)
+        return digest, len(data)
+
+    def sync(self):
+        # Fsyncs every blob written with sync=False, then each fan-out directory they went to and the store's
+        # own directory and its parent, which may have been created for them
+        if not self.unsynced:
+            return
+        for path in self.unsynced:
+            with open(path, 'rb') as f:
+                os.fsync(f.fileno())
+        root = os.path.abspath(self.directory)
+        for directory in {os.path.dirname(path) for path in self.unsynced} | {root, os.path.dirname(root)}:
+            sync_directory(directory)
+        self.unsynced.clear()
+
+    def read(self, digest):
+        with open(self.path(digest), 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return ''  # Empty files cannot be mapped
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                return str(mm, 'utf-8')
+
+    def stream(self, digest, chunk_size=BLOB_CHUNK_SIZE):
+        decoder = codecs.getincrementaldecoder('utf-8')()
+        with open(self.path(digest), 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                yield decoder.decode(chunk)
+        yield decoder.decode(b'', final=True)
+
+    def copy_to(self, other, digest):
+        # Unsynced: the caller makes every copy durable at once with other.sync()
+        if not os.path.exists(other.path(digest)):
+            other.put(self.read(digest), sync=False)
+
+
+blobs = BlobStore()  # Opened on the data file's blob directory when it is loaded
+
+
+MINHASH_EMPTY = 2 ** 64 - 1            # Bin that no shingle hashed into
+MINHASH_OFFSET = 2 ** 64 // MINHASH_BINS  # Above every bin value, so borrowed values stay distinct
+
+
+def shingles(content):
+    # Overlapping character runs of the text with case and whitespace normalized
+    text = ' '.join(content.lower().split())
+    if len(text) <= SHINGLE_SIZE:
+        return {text} if text else set()
+    return {text[i:i + SHINGLE_SIZE] for i in range(len(text) - SHINGLE_SIZE + 1)}
+
+
+def minhash(content):
+    # One permutation hashing: every shingle is hashed once, its hash picks a bin
+    # and the rest of it competes for that bin's minimum. Two signatures agree on
+    # a bin with probability equal to the Jaccard similarity of the shingle sets.
+    # Empty bins borrow the value of the next filled bin, offset by the distance.
+    # Returns None for a blank solution, which has nothing to compare.
+    values = [MINHASH_EMPTY] * MINHASH_BINS
+    for h in map(hash, shingles(content)):
+        h &= MINHASH_EMPTY
+        b = h % MINHASH_BINS
+        h //= MINHASH_BINS
+        if h < values[b]:
+            values[b] = h
+    signature = array.array('Q', values)
+    filled = None
+    for i in range(2 * MINHASH_BINS - 1, -1, -1):
+        b = i % MINHASH_BINS
+        if values[b] != MINHASH_EMPTY:
+            filled = i
+        elif filled is None:
+            continue
+        elif i < MINHASH_BINS:
+            signature[b] = values[filled % MINHASH_BINS] + (filled - i) * MINHASH_OFFSET
+    return None if filled is None else signature
+
+
+def band_keys(signature):
+    rows = MINHASH_BINS // MINHASH_BANDS
+    return [signature[i:i + rows].tobytes() for i in range(0, MINHASH_BINS, rows)]
+
+
+def estimate_similarity(signature, other):
+    return sum(a == b for a, b in zip(signature, other)) / MINHASH_BINS
+
+
+# MinHash signatures by blob digest. submit_solution adds the signature while
+# it still holds the body, and identical submissions share it, so the bodies
+# are read back only for solutions loaded from storage.
+class SignatureCache:
+    def __init__(self, capacity=SIGNATURE_CACHE_SIZE):
+        self.capacity = capacity
+        self.signatures = collections.OrderedDict()  # digest -> signature or None, least recently used first
+        self.lock = threading.Lock()  # Shared by the service's worker threads
+
+    def add(self, digest, content):
+        with self.lock:
+            if digest in self.signatures:
+                self.signatures.move_to_end(digest)
+                return self.signatures[digest]
+        signature = minhash(content)
+        with self.lock:
+            self.signatures[digest] = signature
+            while len(self.signatures) > self.capacity:
+                self.signatures.popitem(last=False)
+        return signature
+
+    def get(self, digest):
+        with self.lock:
+            if digest in self.signatures:
+                self.signatures.move_to_end(digest)
+                return self.signatures[digest]
+        return self.add(digest, blobs.read(digest))
+
+
+signatures = SignatureCache()
+
+
+# Locality sensitive hashing over the MinHash signatures of one assignment's
+# solutions. Each signature is cut into MINHASH_BANDS bands and filed under
+# every band; only solutions sharing a band are compared, so listing similar
+# pairs costs about one comparison per likely pair instead of one per pair of
+# students. Students with the same digest share one signature and are reported
+# as identical without comparing anything.
+class SimilarityIndex:
+    __slots__ = ('students', 'holders', 'signatures', 'buckets')
+
+    def __init__(self):
+        self.students = {}    # student_id -> digest
+        self.holders = {}     # digest -> set of student_ids
+        self.signatures = {}  # digest -> signature
+        self.buckets = [{} for _ in range(MINHASH_BANDS)]  # band -> band values -> set of digests
+
+    def add(self, student_id, digest):
+        if self.students.get(student_id) == digest:
+            return
+        self.discard(student_id)
+        holders = self.holders.get(digest)
+        if holders is None:
+            signature = signatures.get(digest)
+            if signature is None:
+                return
+            holders = self.holders[digest] = set()
+            self.signatures[digest] = signature
+            for bucket, key in zip(self.buckets, band_keys(signature)):
+                bucket.setdefault(key, set()).add(digest)
+        holders.add(student_id)
+        self.students[student_id] = digest
+
+    def discard(self, student_id):
+        digest = self.students.pop(student_id, None)
+        if digest is None:
+            return
+        holders = self.holders[digest]
+        holders.discard(student_id)
+        if not holders:
+            del self.holders[digest]
+            for bucket, key in zip(self.buckets, band_keys(self.signatures.pop(digest))):
+                digests = bucket[key]
+                digests.discard(digest)
+                if not digests:
+                    del bucket[key]
+
+    def pairs(self, threshold):
+        found = []
+        for holders in self.holders.values():
+            found.extend((1.0, *pair) for pair in itertools.combinations(sorted(holders), 2))
+        compared = set()
+        for bucket in self.buckets:
+            for digests in bucket.values():
+                for pair in itertools.combinations(sorted(digests), 2):
+                    if pair in compared:
+                        continue
+                    compared.add(pair)
+                    similarity = estimate_similarity(self.signatures[pair[0]], self.signatures[pair[1]])
+                    if similarity >= threshold:
+                        found.extend((similarity, *sorted(students)) for students
+                                     in itertools.product(self.holders[pair[0]], self.holders[pair[1]]))
+        found.sort(key=lambda pair: (-pair[0], pair[1], pair[2]))
+        return found
+
+
+# Opaque session tokens handed out after one successful sign-in, so later calls
+# resolve their user with a dictionary lookup instead of checking credentials.
+# Tokens expire ttl seconds after they are issued, the least recently used are
+# dropped beyond capacity, and with a filename they survive restarts.
+class SessionManager:
+    def __init__(self, ttl=SESSION_TTL, capacity=SESSION_CAPACITY):
+        self.ttl = ttl
+        self.capacity = capacity
+        self.tokens = collections.OrderedDict()  # token -> (user_id, expires_at), least recently used first
+        self.users = None
+        self.filename = None
+        self.log = None      # The sessions file, open for appending
+        self.logged = 0      # Records in the sessions file
+        self.lock = threading.Lock()       # The service resolves tokens from its worker threads
+        self.file_lock = threading.Lock()  # Serializes appends and compactions; taken before self.lock
+
+    def open(self, users, filename=None):
+        # With a filename, issued and revoked tokens are appended to it as JSON lines and replayed here
+        self.close()
+        self.users = users
+        self.filename = filename
+        self.tokens.clear()
+        if filename is not None:
+            self.load()
+            self.compact()
+
+    def load(self):
+        try:
+            with open(self.filename, 'r') as f:
+                text = f.read()
+        except FileNotFoundError:
+            return
+        if text.startswith('{'):  # Saved as a single object before the file became a log
+            entries = [['issue', token, user_id, expires_at]
+                       for token, (user_id, expires_at) in json.loads(text).items()]
+        else:
+            entries = []
+            for line in text.splitlines():
+                try:
+                    entries.append(json.loads(line))
+                except json.JSONDecodeError:
+                    pass  # A record cut short by a crash
+        for entry in entries:
+            if entry[0] == 'issue':
+                _, token, user_id, expires_at = entry
+                self.tokens[token] = (user_id, expires_at)
+                while len(self.tokens) > self.capacity:
+                    self.tokens.popitem(last=False)
+            else:
+                self.tokens.pop(entry[1], None)
+        now = time.time()
+        for token, (user_id, expires_at) in list(self.tokens.items()):
+            if expires_at <= now or user_id not in self.users:
+                del self.tokens[token]
+
+    def issue(self, user):
+        token = secrets.token_urlsafe(32)
+        expires_at = time.time() + self.ttl
+        with self.lock:
+            self.tokens[token] = (user.user_id, expires_at)
+            while len(self.tokens) > self.capacity:
+                self.tokens.popitem(last=False)
+        self.append('issue', token, user.user_id, expires_at)
+        return token
+
+    def resolve(self, token):
+        with self.lock:
+            entry = self.tokens.get(token)
+            if entry is None:
+                return None
+            if entry[1] <= time.time():
+                del self.tokens[token]
+                return None
+            self.tokens.move_to_end(token)
+        return self.users.get(entry[0])
+
+    def revoke(self, token):
+        with self.lock:
+            revoked = self.tokens.pop(token, None) is not None
+        if revoked:
+            self.append('revoke', token)
+
+    def append(self, *entry):
+        # One short write per sign-in or log-out; evicted and expired tokens are dropped by compact
+        if self.filename is None:
+            return
+        with self.file_lock:
+            self.log.write(json.dumps(entry) + '\n')
+            self.log.flush()
+            self.logged += 1
+            full = self.logged > 2 * self.capacity
+        if full:
+            self.compact()
+
+    def compact(self):
+        # Rewrites the file with one record per live token; only the owner may read it, and it is
+        # replaced atomically like the snapshots
+        if self.filename is None:
+            return
+        with self.file_lock:
+            with self.lock:
+                live = list(self.tokens.items())
+            temp_filename = self.filename + '.tmp'
+            with open(os.open(temp_filename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w') as f:
+                for token, (user_id, expires_at) in live:
+                    f.write(json.dumps(['issue', token, user_id, expires_at]) + '\n')
+            os.replace(temp_filename, self.filename)
+            if self.log is not None:
+                self.log.close()
+            self.log = open(os.open(self.filename, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600), 'a')
+            self.logged = len(live)
+
+    def close(self):
+        if self.log is not None:
+            self.compact()
+            self.log.close()
+            self.log = None
+
+
+sessions = SessionManager()
+
+
+# Append-only log of mutations applied on top of the last snapshot. Each record
+# is one JSON line, handed to the OS as soon as it is appended and fsynced every
+# batch_size records, so a mutation costs a write proportional to the change.
+# Deferred records (bulk imports) stay buffered until the caller syncs. A torn
+# record left at the tail by a crash is cut off before new records are appended,
+# or it would swallow the first of them on the next read.
+class Journal:
+    def __init__(self, filename, batch_size=JOURNAL_BATCH_SIZE):
+        self.filename = filename
+        self.batch_size = batch_size
+        self.seq = 0
+        self.pending = 0
+        self.file = None
+        self.valid_size = None  # Bytes up to the end of the last whole record, once the journal was read
+
+    def open(self, seq):
+        self.seq = seq
+        self.file = open(self.filename, 'a')
+        if self.valid_size is not None and self.file.tell() > self.valid_size:
+            self.file.truncate(self.valid_size)
+            self.file.flush()
+            os.fsync(self.file.fileno())
+
+    def append(self, op, fields, deferred=False):
+        self.seq += 1
+        self.file.write(json.dumps({'seq': self.seq, 'op': op, **fields}) + '\n')
+        self.pending += 1
+        if not deferred:
+            self.file.flush()
+            if self.pending >= self.batch_size:
+                self.sync()
+
+    def sync(self):
+        if self.file is not None and self.pending:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.pending = 0
+
+    def read(self, after_seq=0):
+        self.valid_size = 0
+        try:
+            with open(self.filename, 'rb') as f:
+                for line in f:
+                    try:
+                        if not line.endswith(b'\n'):
+                            raise ValueError
+                        entry = json.loads(line)
+                    except ValueError:
+                        break  # Torn write at the tail of the journal after a crash
+                    self.valid_size += len(line)
+                    if entry['seq'] > after_seq:
+                        yield entry
+        except FileNotFoundError:
+            return
+
+    def truncate(self):
+        if self.file is not None:
+            self.file.close()
+        self.file = open(self.filename, 'w')
+        self.pending = 0
+        self.valid_size = None
+
+    def close(self):
+        if self.file is not None:
+            self.sync()
+            self.file.close()
+            self.file = None
+
+
+storage = None  # The open storage backend, or None while loading and replaying
+
+
+def record(op, **fields):
+    if storage is not None:
+        with storage.lock:
+            storage.record(op, fields)
+
+
+def journal_filename(filename):
+    # Named after the whole file name, so ems_data.json and ems_data.emsb side by side never share a journal
+    return filename + '.journal'
+
+
+def adopt_legacy_journal(filename):
+    # Journals used to be named without the data file's extension (ems_data.journal). One left over is taken
+    # over by the data file unless a snapshot of the other format next to it could also be its owner.
+    root = os.path.splitext(filename)[0]
+    legacy, journal = root + '.journal', journal_filename(filename)
+    if legacy == journal or not os.path.exists(legacy) or os.path.exists(journal):
+        return
+    others = [root + extension for extension in ('.json', '.emsb')
+              if root + extension != filename and os.path.exists(root + extension)]
+    if others:
+        print(f"Warning: {legacy} may belong to {others[0]}, so {filename} does not replay it.", file=sys.stderr)
+        return
+    os.replace(legacy, journal)
+
+
+def blob_directory(filename):
+    return os.path.splitext(filename)[0] + '.blobs'
+
+
+def user_from_dict(user_data):
+    if 'courses_created' in user_data:
+        return Doctor.from_dict(user_data)
+    elif 'courses_registered' in user_data:
+        return Student.from_dict(user_data)
+    return User.from_dict(user_data)
+
+
+def apply_record(users, entry):
+    op = entry['op']
+    if op == 'sign_up':
+        users.add(user_from_dict(entry['user']))
+    elif op == 'create_course':
+        users[entry['doctor_id']].create_course(entry['course_name'], entry['course_code'])
+    elif op == 'register_course':
+        users[entry['student_id']].register_course(catalog.get(entry['course_code']))
+    elif op == 'unregister_course':
+        users[entry['student_id']].unregister_course(catalog.get(entry['course_code']))
+    elif op == 'add_assignment':
+        catalog.get(entry['course_code']).add_assignment(entry['assignment_title'], entry['description'], entry['deadline'])
+    elif op == 'submit_solution':
+        assignment = catalog.get(entry['course_code']).assignments[entry['assignment']]
+        assignment.submit_blob(users[entry['student_id']], *solution_blob(entry), entry.get('submitted_at'))
+    elif op == 'grade_solution':
+        assignment = catalog.get(entry['course_code']).assignments[entry['assignment']]
+        assignment.grade_solution(users[entry['student_id']], parse_grade(entry['grade']), entry['comments'])
+    elif op == 'set_test_spec':
+        catalog.get(entry['course_code']).assignments[entry['assignment']].set_test_spec(entry['test_spec'])
+    else:
+        raise ValueError(f"Unknown journal operation '{op}'.")
+    users.journal_seq = entry['seq']
+
+
+# Base class for storage backends. load() rebuilds the object model, record()
+# persists a single mutation, and the query methods answer the menus' reports.
+# The defaults walk the object model; backends with an index override them.
+class Storage:
+    def __init__(self, filename):
+        self.filename = filename
+        self.users = None
+        self.batching = False
+        self.lock = threading.RLock()  # Serializes records and syncs from the service's worker threads
+
+    def load(self):
+        raise NotImplementedError
+
+    def save(self, users):
+        raise NotImplementedError
+
+    def record(self, op, fields):
+        raise NotImplementedError
+
+    def open(self, users):
+        self.users = users
+
+    def sync(self):
+        pass
+
+    @contextlib.contextmanager
+    def batch(self):
+        # Changes recorded inside the block are made durable together when it ends
+        self.batching = True
+        try:
+            yield
+        finally:
+            self.batching = False
+            self.sync()
+
+    def compact(self, users):
+        pass
+
+    def close(self):
+        pass
+
+    def open_blobs(self):
+        blobs.open(blob_directory(self.filename))
+
+    def save_blobs(self):
+        # Data files only hold digests; saving under another name (a migration) copies the bodies along
+        target = BlobStore(blob_directory(self.filename))
+        if blobs.directory is None or os.path.abspath(target.directory) == os.path.abspath(blobs.directory):
+            return
+        for course in list(catalog.courses.values()):
+            for assignment in course.assignments:
+                for solution in assignment.solutions.values():
+                    blobs.copy_to(target, solution.digest)
+        target.sync()  # Every copied body is durable before the data file that names them is written
+
+    def list_courses(self, user):
+        return user.list_courses()
+
+    def available_courses(self, student):
+        return catalog.available_courses(student)
+
+    def student_grades(self, student):
+        return student.view_grades()
+
+    def assignment_grades(self, assignment):
+        # Generated row by row, so a report can be written out without holding all of it
+        for student_id, solution in assignment.solutions.items():
+            yield student_id, self.users[student_id].full_name, solution.grade, solution.comments
+
+
+class JsonStorage(Storage):
+    def __init__(self, filename, batch_size=JOURNAL_BATCH_SIZE):
+        super().__init__(filename)
+        self.journal = Journal(journal_filename(filename), batch_size)
+
+    def load(self):
+        catalog.clear()
+        self.open_blobs()
+        users = UserDirectory()
+        try:
+            self.load_snapshot(users)
+        except FileNotFoundError:
+            pass
+        adopt_legacy_journal(self.filename)
+        for entry in self.journal.read(after_seq=users.journal_seq):
+            apply_record(users, entry)
+        return users
+
+    def load_snapshot(self, users):
+        with open(self.filename, 'r') as f:
+            data = json.load(f)
+
+        enrollments = []
+        for user_data in data['users']:
+            user = user_from_dict(user_data)
+            if isinstance(user, Student):
+                enrollments.append((user, user_data['courses_registered']))
+            users.load(user)
+
+        # Linking students to courses once every doctor's courses are in the catalog
+        for student, course_codes in enrollments:
+            for course_code in course_codes:
+                course = catalog.get(course_code)
+                if course:
+                    student.register_course(course)
+        users.journal_seq = data.get('journal_seq', 0)
+        users.next_user_id = max(users.next_user_id, data.get('next_user_id', 1))
+
+    def snapshot_seq(self, users):
+        return self.journal.seq if self.journal.file is not None else users.journal_seq
+
+    def save(self, users):
+        data = {
+            'journal_seq': self.snapshot_seq(users),
+            'next_user_id': users.next_user_id,
+            'users': [user.to_dict() for user in users.values()]
+        }
+        self.save_blobs()
+        # Write the snapshot next to the old one and swap it in, so a crash never leaves a partial file
+        temp_filename = self.filename + '.tmp'
+        with open(temp_filename, 'w') as f:
+            json.dump(data, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_filename, self.filename)
+
+    def open(self, users):
+        super().open(users)
+        self.journal.open(users.journal_seq)
+
+    def record(self, op, fields):
+        self.journal.append(op, fields, deferred=self.batching)
+
+    def sync(self):
+        with self.lock:
+            self.journal.sync()
+
+    def compact(self, users):
+        # Fold the journal into a fresh snapshot. The snapshot records the last
+        # journal sequence number, so records are never applied twice even if we
+        # crash between writing the snapshot and truncating the journal.
+        self.journal.sync()
+        self.save(users)
+        if self.journal.file is not None:
+            self.journal.truncate()
+        else:
+            open(self.journal.filename, 'w').close()
+
+    def close(self):
+        self.journal.close()
+
+
+BINARY_MAGIC = b'EMSB'
+BINARY_VERSION = 5
+BINARY_HEADERS = {
+    1: struct.Struct('<4sHHIIIIIIQ'),
+    2: struct.Struct('<4sHHIIIIIIQI'),  # Version 1 plus the next user ID
+    3: struct.Struct('<4sHHIIIIIIQI'),  # Solutions reference the blob store
+    4: struct.Struct('<4sHHIIIIIIQI'),  # Assignments carry a test spec
+    5: struct.Struct('<4sHHIIIIIIQI'),  # Solutions carry their submission time
+}
+BINARY_HEADER = BINARY_HEADERS[BINARY_VERSION]
+BINARY_USER = struct.Struct('<IBIIII')       # user_id, kind, username, password, full_name, email
+BINARY_COURSE = struct.Struct('<IIIII')      # course_code, course_name, provided_by, first assignment, assignment count
+BINARY_ENROLLMENT = struct.Struct('<II')     # student_id, course index
+BINARY_ASSIGNMENT = struct.Struct('<IIIIII')  # title, description, deadline, test spec as JSON, first solution, solution count
+BINARY_PLAIN_ASSIGNMENT = struct.Struct('<IIIII')  # Before version 4: the same without the test spec
+BINARY_SOLUTION = struct.Struct('<IIIIId')   # student_id, digest, size, grade as text, comments, submitted_at or NaN
+BINARY_UNTIMED_SOLUTION = struct.Struct('<IIIII')  # Before version 5: the same without the submission time
+BINARY_INLINE_SOLUTION = struct.Struct('<IIII')  # Before version 3: student_id, content, grade as text, comments
+BINARY_STRING_BOUNDS = struct.Struct('<QQ')  # Start and end of a string in the blob, end including its NUL
+BINARY_KINDS = (User, Doctor, Student)
+
+
+# Versioned binary snapshot: a header with section counts, fixed-layout records
+# for users, courses, enrollments, assignments and solutions that reference a
+# deduplicated string table (entry 0 stands for None), then the string offsets
+# and the string blob. The file stays memory-mapped and records are decoded with
+# struct.iter_unpack on demand. Mutations are journaled like the JSON snapshot.
+class BinaryStorage(JsonStorage):
+    def __init__(self, filename, batch_size=JOURNAL_BATCH_SIZE):
+        super().__init__(filename, batch_size)
+        self.mm = None
+        self.assignment_ranges = {}  # course_code -> (first assignment record, assignment count)
+
+    def map_snapshot(self):
+        # Maps the file and locates its sections; returns the header's fields
+        if self.mm is not None:
+            self.view.release()
+            try:
+                self.mm.close()
+            except BufferError:
+                pass  # A record iterator still holds a view; the old map goes once it is collected
+        with open(self.filename, 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.view = view = memoryview(self.mm)
+        magic, version = struct.unpack_from('<4sH', view)
+        header = BINARY_HEADERS.get(version)
+        if magic != BINARY_MAGIC or header is None:
+            raise ValueError(f"{self.filename} is not an EMS snapshot of version {BINARY_VERSION} or older.")
+        fields = header.unpack_from(view)
+        (magic, version, flags, n_strings, n_users, n_courses, n_enrollments, n_assignments, n_solutions,
+         journal_seq, *extra) = fields
+        self.assignment_record = BINARY_ASSIGNMENT if version >= 4 else BINARY_PLAIN_ASSIGNMENT
+        self.solution_record = (BINARY_SOLUTION if version >= 5 else BINARY_UNTIMED_SOLUTION if version >= 3
+                                else BINARY_INLINE_SOLUTION)
+
+        self.offsets = {}
+        offset = header.size
+        for record, count in ((BINARY_USER, n_users), (BINARY_COURSE, n_courses), (BINARY_ENROLLMENT, n_enrollments),
+                              (self.assignment_record, n_assignments), (self.solution_record, n_solutions)):
+            self.offsets[record] = offset
+            offset += record.size * count
+        self.strings_offset = offset
+        self.blob_offset = offset + 8 * (n_strings + 1)
+        return fields
+
+    def load_snapshot(self, users):
+        (magic, version, flags, n_strings, n_users, n_courses, n_enrollments, n_assignments, n_solutions,
+         journal_seq, *extra) = self.map_snapshot()
+        next_user_id = extra[0] if extra else 1
+
+        # Users and course headers are decoded eagerly; assignments and
+        # solutions stay in the mapped file until a course is opened.
+        string = self.string
+        for user_id, kind, username, password, full_name, email in self.records(BINARY_USER, 0, n_users):
+            users.load(BINARY_KINDS[kind](user_id, string(username), string(password), string(full_name),
+                                         string(email), hashed=True))
+        courses = []
+        self.assignment_ranges = {}
+        for course_code, course_name, provided_by, first_assignment, n_course_assignments in \
+                self.records(BINARY_COURSE, 0, n_courses):
+            course = Course(string(course_name), string(course_code), users[provided_by], loader=self.load_assignments)
+            catalog.add_course(course)
+            courses.append(course)
+            self.assignment_ranges[course.course_code] = (first_assignment, n_course_assignments)
+        for student_id, course_index in self.records(BINARY_ENROLLMENT, 0, n_enrollments):
+            users[student_id].register_course(courses[course_index])
+        users.journal_seq = journal_seq
+        users.next_user_id = max(users.next_user_id, next_user_id)
+
+    def compact(self, users):
+        # The fresh snapshot holds every change: it is mapped in place of the old one, and every course,
+        # including the ones created since, can be evicted and read back from it
+        super().compact(users)
+        n_courses = self.map_snapshot()[5]
+        for course_code, _, _, first_assignment, n_course_assignments in self.records(BINARY_COURSE, 0, n_courses):
+            course = catalog.get(self.string(course_code))
+            self.assignment_ranges[course.course_code] = (first_assignment, n_course_assignments)
+            course.loader = self.load_assignments
+            course.modified = False
+            if course._assignments is not None:
+                catalog.touch(course)
+
+    def records(self, record, first, count):
+        start = self.offsets[record] + record.size * first
+        return record.iter_unpack(self.view[start:start + record.size * count])
+
+    def string(self, index):
+        if index == 0:
+            return None
+        start, end = BINARY_STRING_BOUNDS.unpack_from(self.view, self.strings_offset + 8 * index)
+        return str(self.view[self.blob_offset + start:self.blob_offset + end - 1], 'utf-8')
+
+    def load_assignments(self, course):
+        string = self.string
+        first_assignment, n_course_assignments = self.assignment_ranges[course.course_code]
+        assignments = []
+        for fields in self.records(self.assignment_record, first_assignment, n_course_assignments):
+            if self.assignment_record is BINARY_PLAIN_ASSIGNMENT:
+                fields = fields[:3] + (0,) + fields[3:]
+            title, description, deadline, test_spec, first_solution, n_assignment_solutions = fields
+            assignment = Assignment(string(title), string(description), string(deadline))
+            if test_spec:
+                assignment.test_spec = json.loads(string(test_spec))
+            if self.solution_record is BINARY_SOLUTION:
+                for student_id, digest, size, grade, comments, submitted_at in \
+                        self.records(BINARY_SOLUTION, first_solution, n_assignment_solutions):
+                    assignment.solutions[student_id] = Solution(string(digest), size, parse_grade(string(grade)),
+                                                                string(comments),
+                                                                None if math.isnan(submitted_at) else submitted_at)
+            elif self.solution_record is BINARY_UNTIMED_SOLUTION:
+                for student_id, digest, size, grade, comments in \
+                        self.records(BINARY_UNTIMED_SOLUTION, first_solution, n_assignment_solutions):
+                    assignment.solutions[student_id] = Solution(string(digest), size, parse_grade(string(grade)),
+                                                                string(comments))
+            else:
+                # Older snapshots kept the bodies inline; they move to the blob store as the course is opened
+                for student_id, content, grade, comments in \
+                        self.records(BINARY_INLINE_SOLUTION, first_solution, n_assignment_solutions):
+                    assignment.solutions[student_id] = Solution(*blobs.put(string(content)), parse_grade(string(grade)),
+                                                                string(comments))
+            assignments.append(assignment)
+        return assignments
+
+    def save(self, users):
+        strings = {None: 0}
+
+        def ref(value):
+            index = strings.get(value)
+            if index is None:
+                index = strings[value] = len(strings)
+            return index
+
+        user_records = []
+        for user in users.values():
+            kind = 1 if isinstance(user, Doctor) else 2 if isinstance(user, Student) else 0
+            user_records.append(BINARY_USER.pack(user.user_id, kind, ref(user.username), ref(user.password),
+                                                 ref(user.full_name), ref(user.email)))
+
+        course_records, assignment_records, solution_records = [], [], []
+        course_indexes = {}
+        for course in catalog.courses.values():
+            course_indexes[course.course_code] = len(course_records)
+            course_records.append(BINARY_COURSE.pack(ref(course.course_code), ref(course.course_name),
+                                                     course.provided_by.user_id, len(assignment_records),
+                                                     len(course.assignments)))
+            for assignment in course.assignments:
+                assignment_records.append(BINARY_ASSIGNMENT.pack(
+                    ref(assignment.assignment_title), ref(assignment.description), ref(assignment.deadline),
+                    ref(None if assignment.test_spec is None else json.dumps(assignment.test_spec)),
+                    len(solution_records), len(assignment.solutions)))
+                for student_id, solution in assignment.solutions.items():
+                    grade = None if solution.grade is None else str(solution.grade)
+                    solution_records.append(BINARY_SOLUTION.pack(
+                        student_id, ref(solution.digest), solution.size, ref(grade), ref(solution.comments),
+                        math.nan if solution.submitted_at is None else solution.submitted_at))
+
+        enrollment_records = [BINARY_ENROLLMENT.pack(user.user_id, course_indexes[course.course_code])
+                              for user in users.values() if isinstance(user, Student)
+                              for course in user.list_courses()]
+
+        encoded = [b''] + [value.encode('utf-8') for value in itertools.islice(strings, 1, None)]
+        bounds = [0]
+        for value in encoded:
+            bounds.append(bounds[-1] + len(value) + 1)
+        header = BINARY_HEADER.pack(BINARY_MAGIC, BINARY_VERSION, 0, len(strings), len(user_records),
+                                    len(course_records), len(enrollment_records), len(assignment_records),
+                                    len(solution_records), self.snapshot_seq(users), users.next_user_id)
 
-    # Linking students to courses after loading
+        self.save_blobs()
+        temp_filename = self.filename + '.tmp'
+        with open(temp_filename, 'wb') as f:
+            f.write(header)
+            for section in (user_records, course_records, enrollment_records, assignment_records, solution_records):
+                f.write(b''.join(section))
+            f.write(struct.pack(f'<{len(bounds)}Q', *bounds))
+            f.write(b''.join(value + b'\0' for value in encoded))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_filename, self.filename)
+
+
+SQLITE_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS users (
+    user_id INTEGER PRIMARY KEY,
+    kind TEXT NOT NULL,
+    username TEXT NOT NULL,
+    password TEXT NOT NULL,
+    full_name TEXT NOT NULL,
+    email TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS users_username ON users (username);  -- Unique for sign-ups, not in older data files
+CREATE TABLE IF NOT EXISTS courses (
+    course_code TEXT PRIMARY KEY,
+    course_name TEXT NOT NULL,
+    provided_by INTEGER NOT NULL REFERENCES users (user_id)
+);
+CREATE INDEX IF NOT EXISTS courses_provided_by ON courses (provided_by);
+CREATE TABLE IF NOT EXISTS enrollments (
+    student_id INTEGER NOT NULL REFERENCES users (user_id),
+    course_code TEXT NOT NULL REFERENCES courses (course_code),
+    UNIQUE (student_id, course_code)
+);
+CREATE INDEX IF NOT EXISTS enrollments_course_code ON enrollments (course_code);
+CREATE TABLE IF NOT EXISTS assignments (
+    assignment_id INTEGER PRIMARY KEY,
+    course_code TEXT NOT NULL REFERENCES courses (course_code),
+    position INTEGER NOT NULL,
+    assignment_title TEXT NOT NULL,
+    description TEXT NOT NULL,
+    deadline TEXT NOT NULL,
+    test_spec TEXT,
+    UNIQUE (course_code, position)
+);
+CREATE TABLE IF NOT EXISTS solutions (
+    assignment_id INTEGER NOT NULL REFERENCES assignments (assignment_id),
+    student_id INTEGER NOT NULL REFERENCES users (user_id),
+    digest TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    grade NUMERIC,
+    comments TEXT,
+    submitted_at REAL,
+    UNIQUE (assignment_id, student_id)
+);
+CREATE INDEX IF NOT EXISTS solutions_student ON solutions (student_id);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value
+);
+'''
+
+SQLITE_ADDED_COLUMNS = (  # Columns added after the first schema, and to older databases when they are opened
+    ('assignments', 'test_spec', 'TEXT'),
+    ('solutions', 'submitted_at', 'REAL'),
+)
+
+ASSIGNMENT_ID_SQL = '(SELECT assignment_id FROM assignments WHERE course_code = ? AND position = ?)'
+
+
+# Normalized SQLite backend. Every mutation is applied as a single-row statement
+# and committed in batches, and the reports run as indexed queries.
+class SqliteStorage(Storage):
+    def __init__(self, filename, batch_size=JOURNAL_BATCH_SIZE):
+        super().__init__(filename)
+        self.batch_size = batch_size
+        self.pending = 0
+        self.connection = sqlite3.connect(filename, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode = WAL')
+        self.connection.executescript(SQLITE_SCHEMA)
+        if 'content' in [column for _, column, *_ in self.connection.execute('PRAGMA table_info(solutions)')]:
+            self.move_contents_to_blobs()
+        for table, column, column_type in SQLITE_ADDED_COLUMNS:
+            if column not in [name for _, name, *_ in self.connection.execute(f'PRAGMA table_info({table})')]:
+                with self.connection:
+                    self.connection.execute(f'ALTER TABLE {table} ADD COLUMN {column} {column_type}')
+
+    def move_contents_to_blobs(self):
+        # Databases from before the blob store kept solution bodies inline
+        store = BlobStore(blob_directory(self.filename))
+        with self.connection:
+            self.connection.execute('ALTER TABLE solutions ADD COLUMN digest TEXT')
+            self.connection.execute('ALTER TABLE solutions ADD COLUMN size INTEGER')
+            last_rowid = 0
+            while True:
+                rows = self.connection.execute('SELECT rowid, content FROM solutions WHERE rowid > ? ORDER BY rowid LIMIT 1000',
+                                               (last_rowid,)).fetchall()
+                if not rows:
+                    break
+                self.connection.executemany('UPDATE solutions SET digest = ?, size = ? WHERE rowid = ?',
+                                            [(*store.put(content), rowid) for rowid, content in rows])
+                last_rowid = rows[-1][0]
+            self.connection.execute('ALTER TABLE solutions DROP COLUMN content')
+
+    def load(self):
+        catalog.clear()
+        self.open_blobs()
+        users = UserDirectory()
+        classes = {'doctor': Doctor, 'student': Student, 'user': User}
+        for user_id, kind, username, password, full_name, email in self.connection.execute(
+                'SELECT user_id, kind, username, password, full_name, email FROM users ORDER BY user_id'):
+            users.load(classes[kind](user_id, username, password, full_name, email, hashed=True))
+        row = self.connection.execute("SELECT value FROM meta WHERE key = 'next_user_id'").fetchone()
+        if row is not None:
+            users.next_user_id = max(users.next_user_id, row[0])
+
+        # Assignments and solutions are only queried once a course is opened
+        for course_code, course_name, provided_by in self.connection.execute(
+                'SELECT course_code, course_name, provided_by FROM courses ORDER BY rowid'):
+            catalog.add_course(Course(course_name, course_code, users[provided_by], loader=self.load_assignments))
+
+        for student_id, course_code in self.connection.execute(
+                'SELECT student_id, course_code FROM enrollments ORDER BY rowid'):
+            users[student_id].register_course(catalog.get(course_code))
+        return users
+
+    def load_assignments(self, course):
+        assignments = {}
+        for assignment_id, title, description, deadline, test_spec in self.query(
+                'SELECT assignment_id, assignment_title, description, deadline, test_spec FROM assignments '
+                'WHERE course_code = ? ORDER BY position', (course.course_code,)):
+            assignment = assignments[assignment_id] = Assignment(title, description, deadline)
+            if test_spec is not None:
+                assignment.test_spec = json.loads(test_spec)
+
+        for assignment_id, student_id, digest, size, grade, comments, submitted_at in self.query(
+                'SELECT s.assignment_id, s.student_id, s.digest, s.size, s.grade, s.comments, s.submitted_at '
+                'FROM solutions s JOIN assignments a ON a.assignment_id = s.assignment_id '
+                'WHERE a.course_code = ? ORDER BY s.rowid', (course.course_code,)):
+            assignments[assignment_id].solutions[student_id] = Solution(digest, size, parse_grade(grade), comments,
+                                                                        submitted_at)
+        return list(assignments.values())
+
+    def save(self, users):
+        self.save_blobs()
+        with self.connection:
+            for table in ('solutions', 'assignments', 'enrollments', 'courses', 'users'):
+                self.connection.execute(f'DELETE FROM {table}')
+            for user in users.values():
+                self.insert_user(user)
+            for course in catalog.courses.values():
+                self.connection.execute('INSERT INTO courses (course_code, course_name, provided_by) VALUES (?, ?, ?)',
+                                        (course.course_code, course.course_name, course.provided_by.user_id))
+                for assignment in course.assignments:
+                    cursor = self.connection.execute(
+                        'INSERT INTO assignments (course_code, position, assignment_title, description, deadline, test_spec) '
+                        'VALUES (?, ?, ?, ?, ?, ?)',
+                        (course.course_code, assignment.index, assignment.assignment_title, assignment.description,
+                         assignment.deadline, None if assignment.test_spec is None else json.dumps(assignment.test_spec)))
+                    self.connection.executemany(
+                        'INSERT INTO solutions (assignment_id, student_id, digest, size, grade, comments, submitted_at) '
+                        'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                        [(cursor.lastrowid, student_id, solution.digest, solution.size, solution.grade,
+                          solution.comments, solution.submitted_at)
+                         for student_id, solution in assignment.solutions.items()])
+            for user in users.values():
+                if isinstance(user, Student):
+                    self.connection.executemany('INSERT INTO enrollments (student_id, course_code) VALUES (?, ?)',
+                                                [(user.user_id, course.course_code) for course in user.list_courses()])
+            self.save_next_user_id(users)
+
+    def save_next_user_id(self, users):
+        self.connection.execute("INSERT INTO meta (key, value) VALUES ('next_user_id', ?) "
+                                'ON CONFLICT (key) DO UPDATE SET value = excluded.value', (users.next_user_id,))
+
+    def insert_user(self, user):
+        kind = 'doctor' if isinstance(user, Doctor) else 'student' if isinstance(user, Student) else 'user'
+        self.connection.execute(
+            'INSERT INTO users (user_id, kind, username, password, full_name, email) VALUES (?, ?, ?, ?, ?, ?)',
+            (user.user_id, kind, user.username, user.password, user.full_name, user.email))
+
+    def record(self, op, fields):
+        execute = self.connection.execute
+        if op == 'sign_up':
+            self.insert_user(self.users[fields['user']['user_id']])
+            self.save_next_user_id(self.users)
+        elif op == 'create_course':
+            execute('INSERT INTO courses (course_code, course_name, provided_by) VALUES (?, ?, ?)',
+                    (fields['course_code'], fields['course_name'], fields['doctor_id']))
+        elif op == 'register_course':
+            execute('INSERT INTO enrollments (student_id, course_code) VALUES (?, ?)',
+                    (fields['student_id'], fields['course_code']))
+        elif op == 'unregister_course':
+            execute('DELETE FROM enrollments WHERE student_id = ? AND course_code = ?',
+                    (fields['student_id'], fields['course_code']))
+        elif op == 'add_assignment':
+            execute('INSERT INTO assignments (course_code, position, assignment_title, description, deadline) '
+                    'SELECT ?, COUNT(*), ?, ?, ? FROM assignments WHERE course_code = ?',
+                    (fields['course_code'], fields['assignment_title'], fields['description'],
+                     fields['deadline'], fields['course_code']))
+        elif op == 'submit_solution':
+            execute(f'INSERT INTO solutions (assignment_id, student_id, digest, size, submitted_at) '
+                    f'VALUES ({ASSIGNMENT_ID_SQL}, ?, ?, ?, ?) '
+                    'ON CONFLICT (assignment_id, student_id) DO UPDATE SET digest = excluded.digest, size = excluded.size, '
+                    'submitted_at = excluded.submitted_at, grade = NULL, comments = NULL',
+                    (fields['course_code'], fields['assignment'], fields['student_id'], fields['digest'], fields['size'],
+                     fields['submitted_at']))
+        elif op == 'grade_solution':
+            execute(f'UPDATE solutions SET grade = ?, comments = ? WHERE assignment_id = {ASSIGNMENT_ID_SQL} AND student_id = ?',
+                    (fields['grade'], fields['comments'], fields['course_code'], fields['assignment'], fields['student_id']))
+        elif op == 'set_test_spec':
+            test_spec = fields['test_spec']
+            execute('UPDATE assignments SET test_spec = ? WHERE course_code = ? AND position = ?',
+                    (None if test_spec is None else json.dumps(test_spec), fields['course_code'], fields['assignment']))
+        else:
+            raise ValueError(f"Unknown operation '{op}'.")
+        # Written through, so the course can be evicted and read back from the database
+        course = catalog.get(fields.get('course_code'))
+        if course is not None:
+            course.modified = False
+        self.pending += 1
+        if not self.batching and self.pending >= self.batch_size:
+            self.sync()
+
+    def sync(self):
+        with self.lock:
+            self.connection.commit()
+            self.pending = 0
+
+    def compact(self, users):
+        with self.lock:
+            self.sync()
+            self.connection.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+
+    def close(self):
+        with self.lock:
+            self.sync()
+            self.connection.close()
+
+    def query(self, sql, params=()):
+        # The connection is shared by the service's worker threads, so reads are serialized with the writes
+        with self.lock:
+            return self.connection.execute(sql, params).fetchall()
+
+    def stream(self, sql, params=()):
+        # Like query, but the rows are fetched FETCH_SIZE at a time, taking the lock for each batch only
+        with self.lock:
+            cursor = self.connection.execute(sql, params)
+        while True:
+            with self.lock:
+                rows = cursor.fetchmany(FETCH_SIZE)
+            if not rows:
+                return
+            yield from rows
+
+    def list_courses(self, user):
+        if isinstance(user, Doctor):
+            rows = self.query('SELECT course_code FROM courses WHERE provided_by = ? ORDER BY rowid', (user.user_id,))
+        else:
+            rows = self.query('SELECT course_code FROM enrollments WHERE student_id = ? ORDER BY rowid', (user.user_id,))
+        return [catalog.get(course_code) for course_code, in rows]
+
+    def available_courses(self, student):
+        rows = self.query(
+            'SELECT course_code FROM courses WHERE course_code NOT IN '
+            '(SELECT course_code FROM enrollments WHERE student_id = ?) ORDER BY rowid', (student.user_id,))
+        return [catalog.get(course_code) for course_code, in rows]
+
+    def student_grades(self, student):
+        rows = self.query(
+            'SELECT e.course_code, '
+            '       (SELECT COUNT(*) FROM assignments WHERE course_code = e.course_code), '
+            '       COALESCE(SUM(CAST(s.grade AS REAL)), 0), COUNT(s.student_id) * 100 '
+            'FROM enrollments e '
+            'LEFT JOIN assignments a ON a.course_code = e.course_code '
+            'LEFT JOIN solutions s ON s.assignment_id = a.assignment_id AND s.student_id = e.student_id '
+            'WHERE e.student_id = ? GROUP BY e.course_code ORDER BY e.rowid', (student.user_id,))
+        return {course_code: (num_assignments, int(total_grade) if total_grade == int(total_grade) else total_grade, total_possible)
+                for course_code, num_assignments, total_grade, total_possible in rows}
+
+    def assignment_grades(self, assignment):
+        rows = self.stream(
+            'SELECT u.user_id, u.full_name, s.grade, s.comments FROM solutions s '
+            'JOIN users u ON u.user_id = s.student_id '
+            f'WHERE s.assignment_id = {ASSIGNMENT_ID_SQL} ORDER BY s.rowid',
+            (assignment.course.course_code, assignment.index))
+        for student_id, full_name, grade, comments in rows:
+            yield student_id, full_name, parse_grade(grade), comments
+
+
+def storage_for(filename):
+    if filename.endswith(('.db', '.sqlite', '.sqlite3')):
+        return SqliteStorage(filename)
+    if filename.endswith('.emsb'):
+        return BinaryStorage(filename)
+    return JsonStorage(filename)
+
+
+def save_data(users, filename='ems_data.json'):
+    backend = storage_for(filename)
+    backend.save(users)
+    backend.close()
+
+
+def load_data(filename='ems_data.json'):
+    # The backend is left open: lazily loaded courses fetch from it on demand
+    return storage_for(filename).load()
+
+
+def open_storage(filename='ems_data.json', sessions_filename=None):
+    # Load the data and start persisting every mutation through the backend
+    global storage
+    backend = storage_for(filename)
+    users = backend.load()
+    backend.open(users)
+    sessions.open(users, sessions_filename)
+    storage = backend
+    atexit.register(close_storage)
+    return users
+
+
+def close_storage():
+    global storage
+    if storage is not None:
+        storage.close()
+        storage = None
+    sessions.close()
+
+
+def migrate_data(source, target):
+    # One-shot copy between backends, e.g. ems_data.json -> ems_data.db
+    users = load_data(source)
+    save_data(users, target)
+    return users
+
+
+# Bulk import and export of CSV or JSON-lines files (picked by extension). Rows
+# are streamed, checked and applied one at a time through the domain methods and
+# made durable once per batch. A bad row is reported with its line and skipped.
+def read_rows(filename):
+    with open(filename, 'r', newline='') as f:
+        if filename.endswith('.jsonl'):
+            for line_no, line in enumerate(f, 1):
+                if line.strip():
+                    try:
+                        row = json.loads(line)
+                    except json.JSONDecodeError:
+                        row = None
+                    yield line_no, row if isinstance(row, dict) else None
+        else:
+            reader = csv.DictReader(f)
+            for row in reader:
+                yield reader.line_num, row
+
+
+def write_rows(filename, fields, rows):
+    count = 0
+    with open(filename, 'w', newline='') as f:
+        if filename.endswith('.jsonl'):
+            for row in rows:
+                f.write(json.dumps(dict(zip(fields, row))) + '\n')
+                count += 1
+        else:
+            writer = csv.writer(f)
+            writer.writerow(fields)
+            for row in rows:
+                writer.writerow(row)
+                count += 1
+    return count
+
+
+def bulk_field(row, name, required=True, strip=True):
+    # Keys and names are stripped; free text (strip=False) such as submitted code keeps its whitespace
+    value = row.get(name)
+    value = '' if value is None else str(value)
+    if strip:
+        value = value.strip()
+    if required and not value.strip():
+        raise ValueError(f"Missing {name}.")
+    return value
+
+
+def bulk_user(users, row, kind, field='username'):
+    username = bulk_field(row, field)
+    user = users.find_by_username(username)
+    if not isinstance(user, kind):
+        raise ValueError(f"No {kind.__name__.lower()} with username '{username}'.")
+    return user
+
+
+def bulk_course(row):
+    course_code = bulk_field(row, 'course_code')
+    course = catalog.get(course_code)
+    if course is None:
+        raise ValueError(f"No course with code '{course_code}'.")
+    return course
+
+
+def bulk_assignment(course, row):
+    # Assignments are numbered from 1 in the order they were added, as in the menus
+    number = bulk_field(row, 'assignment')
+    if not number.isdigit() or not 1 <= int(number) <= len(course.assignments):
+        raise ValueError(f"Course '{course.course_code}' has no assignment {number}.")
+    return course.assignments[int(number) - 1]
+
+
+def import_user(users, row):
+    kind = bulk_field(row, 'kind').lower()
+    if kind not in ('doctor', 'student'):
+        raise ValueError("Kind must be 'doctor' or 'student'.")
+    email = bulk_field(row, 'email')
+    if not User.is_valid_email(email):
+        raise ValueError(f"Invalid email '{email}'.")
+    # Exports carry the password hash, hand-written rosters a plain password
+    password_hash = bulk_field(row, 'password_hash', required=False)
+    password = password_hash or bulk_field(row, 'password')
+    user_class = Doctor if kind == 'doctor' else Student
+    users.add(user_class(users.next_user_id, bulk_field(row, 'username'), password, bulk_field(row, 'full_name'),
+                         email, hashed=bool(password_hash)))
+
+
+def import_course(users, row):
+    doctor = bulk_user(users, row, Doctor, field='doctor')
+    doctor.create_course(bulk_field(row, 'course_name'), bulk_field(row, 'course_code'))
+
+
+def import_enrollment(users, row):
+    student = bulk_user(users, row, Student)
+    student.register_course(bulk_course(row))
+
+
+def import_assignment(users, row):
+    course = bulk_course(row)
+    title = bulk_field(row, 'assignment_title')
+    if any(assignment.assignment_title == title for assignment in course.assignments):
+        raise ValueError(f"Course '{course.course_code}' already has an assignment '{title}'.")
+    course.add_assignment(title, bulk_field(row, 'description', required=False, strip=False),
+                          validate_deadline(bulk_field(row, 'deadline')))
+
+
+def import_submission(users, row):
+    student = bulk_user(users, row, Student)
+    course = bulk_course(row)
+    if not catalog.is_registered(student, course.course_code):
+        raise ValueError(f"'{student.username}' is not registered in course '{course.course_code}'.")
+    bulk_assignment(course, row).submit_solution(student, bulk_field(row, 'content', strip=False))
+
+
+def import_grade(users, row):
+    student = bulk_user(users, row, Student)
+    course = bulk_course(row)
+    assignment = bulk_assignment(course, row)
+    if student.user_id not in assignment.solutions:
+        raise ValueError(f"'{student.username}' has not submitted assignment {row['assignment']} of '{course.course_code}'.")
+    # An empty grade clears it, so comment-only rows round-trip
+    assignment.grade_solution(student, bulk_field(row, 'grade', required=False) or None,
+                              bulk_field(row, 'comments', required=False, strip=False) or None)
+
+
+def export_users(users):
+    for user in users.values():
+        kind = 'doctor' if isinstance(user, Doctor) else 'student' if isinstance(user, Student) else 'user'
+        yield user.user_id, kind, user.username, user.password, user.full_name, user.email
+
+
+def export_courses(users):
+    for course in catalog.courses.values():
+        yield course.course_code, course.course_name, course.provided_by.username
+
+
+def export_enrollments(users):
     for user in users.values():
         if isinstance(user, Student):
-            for course_code in user.courses_registered:
-                if course_code in courses:
-                    course = courses[course_code]
-                else:
-                    course = None
-                    for doctor in users.values():
-                        if isinstance(doctor, Doctor):
-                            course = doctor.view_course(course_code)
-                            if course:
-                                courses[course_code] = course
-                                break
-                if course:
-                    user.register_course(course)
+            for course in user.list_courses():
+                yield user.username, course.course_code
+
+
+def export_assignments(users):
+    for course in list(catalog.courses.values()):
+        for assignment in course.assignments:
+            yield course.course_code, assignment.assignment_title, assignment.description, assignment.deadline
+
+
+def export_submissions(users):
+    for course in list(catalog.courses.values()):
+        for assignment in course.assignments:
+            for student_id in assignment.solutions:
+                yield (users[student_id].username, course.course_code, assignment.index + 1,
+                       assignment.get_solution_content(student_id))
+
+
+def export_grades(users):
+    for course in list(catalog.courses.values()):
+        for assignment in course.assignments:
+            for student_id, solution in assignment.solutions.items():
+                if solution.grade is not None or solution.comments is not None:
+                    yield users[student_id].username, course.course_code, assignment.index + 1, solution.grade, solution.comments
+
+
+# kind -> (import a row, export rows, exported columns); exports can be imported back
+BULK_KINDS = {
+    'users': (import_user, export_users, ('user_id', 'kind', 'username', 'password_hash', 'full_name', 'email')),
+    'courses': (import_course, export_courses, ('course_code', 'course_name', 'doctor')),
+    'enrollments': (import_enrollment, export_enrollments, ('username', 'course_code')),
+    'assignments': (import_assignment, export_assignments, ('course_code', 'assignment_title', 'description', 'deadline')),
+    'submissions': (import_submission, export_submissions, ('username', 'course_code', 'assignment', 'content')),
+    'grades': (import_grade, export_grades, ('username', 'course_code', 'assignment', 'grade', 'comments')),
+}
+
+
+def import_file(users, kind, filename, batch_size=BULK_BATCH_SIZE):
+    # Returns the number of imported and rejected rows; rejections are reported on stderr
+    import_row = BULK_KINDS[kind][0]
+    imported = rejected = 0
+    rows = read_rows(filename)
+    while True:
+        batch = list(itertools.islice(rows, batch_size))
+        if not batch:
+            break
+        with storage.batch() if storage is not None else contextlib.nullcontext():
+            for line_no, row in batch:
+                try:
+                    if row is None:
+                        raise ValueError("Malformed row.")
+                    import_row(users, row)
+                    imported += 1
+                except ValueError as error:
+                    rejected += 1
+                    print(f"{filename}:{line_no}: {error}", file=sys.stderr)
+    return imported, rejected
+
+
+def export_file(users, kind, filename):
+    _, export_rows, fields = BULK_KINDS[kind]
+    return write_rows(filename, fields, export_rows(users))
+
+
+# Paginated queries over the courses, assignments, solutions and grades. The
+# rows of a query are generated one at a time and filtered as they go. A single
+# page for the service is the page_size smallest rows after the cursor in the
+# sort order, picked in one pass with a bounded heap, so it never sorts or holds
+# the whole result; the cursor is the sort key of the last row of a page, (is
+# None, value, first column), and stays valid when rows are added between pages.
+# Browsing and sorted exports walk every page, so they sort the rows once instead.
+def course_rows(users, user):
+    for course in storage.list_courses(user) if storage is not None else user.list_courses():
+        yield course.course_code, course.course_name, course.provided_by.full_name, len(course.registered_students)
+
+
+def assignment_rows(users, course):
+    for assignment in course.assignments:
+        yield (assignment.index + 1, assignment.assignment_title, assignment.deadline, assignment.due,
+               len(assignment.solutions), assignment.graded_count)
+
+
+def solution_rows(users, assignment):
+    for student_id, solution in assignment.solutions.items():
+        yield (student_id, users[student_id].full_name, solution.submitted_at, assignment.is_late(solution),
+               solution.grade)
+
+
+def grade_rows(users, assignment):
+    # Through the storage query, which SQLite answers from its index
+    if storage is not None:
+        return storage.assignment_grades(assignment)
+    return ((student_id, users[student_id].full_name, solution.grade, solution.comments)
+            for student_id, solution in assignment.solutions.items())
+
+
+# query -> (rows of a user, course or assignment, columns); the first column is unique
+QUERIES = {
+    'courses': (course_rows, ('course_code', 'course_name', 'doctor', 'students')),
+    'assignments': (assignment_rows, ('assignment', 'assignment_title', 'deadline', 'due', 'submissions', 'graded')),
+    'solutions': (solution_rows, ('student_id', 'full_name', 'submitted_at', 'late', 'grade')),
+    'grades': (grade_rows, ('student_id', 'full_name', 'grade', 'comments')),
+}
+
+
+def query_rows(users, name, source, ungraded=False, grade_below=None):
+    # The rows of a query in storage order, keeping only the ungraded ones or those graded below grade_below
+    make_rows, fields = QUERIES[name]
+    rows = make_rows(users, source)
+    if ungraded or grade_below is not None:
+        if 'grade' not in fields:
+            raise ValueError(f"The {name} have no grades to filter on.")
+        grade = fields.index('grade')
+        if ungraded:
+            rows = (row for row in rows if row[grade] is None)
+        if grade_below is not None:
+            rows = (row for row in rows if row[grade] is not None and row[grade] < grade_below)
+    return rows
+
+
+def query_key(fields, sort):
+    if sort is None:
+        sort = fields[0]
+    if sort not in fields:
+        raise ValueError(f"Cannot sort by '{sort}', choose from {', '.join(fields)}.")
+    index = fields.index(sort)
+    return lambda row: (row[index] is None, row[index], row[0])
+
+
+def query_page(users, name, source, sort=None, descending=False, cursor=None, page_size=PAGE_SIZE, **filters):
+    # Returns (rows, cursor of the next page or None)
+    if not isinstance(page_size, int) or page_size < 1:
+        raise ValueError("Page size must be a positive integer.")
+    key = query_key(QUERIES[name][1], sort)
+    rows = query_rows(users, name, source, **filters)
+    if cursor is not None:
+        cursor = tuple(cursor)  # A list when it came back through JSON
+        rows = (row for row in rows if (key(row) < cursor if descending else key(row) > cursor))
+    # One more row than the page tells whether another page follows
+    page = (heapq.nlargest if descending else heapq.nsmallest)(page_size + 1, rows, key=key)
+    if len(page) <= page_size:
+        return page, None
+    del page[page_size:]
+    return page, key(page[-1])
+
+
+def query_sorted(users, name, source, sort=None, descending=False, **filters):
+    # All the rows in the order of the pages
+    key = query_key(QUERIES[name][1], sort)
+    return sorted(query_rows(users, name, source, **filters), key=key, reverse=descending)
+
+
+def query_pages(users, name, source, sort=None, descending=False, page_size=PAGE_SIZE, **filters):
+    rows = query_sorted(users, name, source, sort, descending, **filters)
+    for start in range(0, len(rows), page_size):
+        yield rows[start:start + page_size]
+
+
+def export_query(users, name, source, filename, sort=None, descending=False, **filters):
+    # Writes the rows as CSV or JSON lines while they are generated, or sorted once when a sort is asked for
+    fields = QUERIES[name][1]
+    if sort is None and not descending:
+        rows = query_rows(users, name, source, **filters)
+    else:
+        rows = query_sorted(users, name, source, sort, descending, **filters)
+    return write_rows(filename, fields, rows)
+
+
+# Autograding: the ungraded solutions of an assignment are checked against its
+# test spec in a pool of worker processes, which read the bodies from the blob
+# store themselves. Solutions are dispatched AUTOGRADE_CHUNK_SIZE at a time and
+# each gets AUTOGRADE_TIMEOUT seconds. Student code never runs in a worker: each
+# test case starts a fresh isolated interpreter in a scratch directory, which is
+# killed, with anything it started, once the solution's time is up. Test cases
+# run under the unprivileged account given with --autograde-user, which must
+# have no access to the data files; the operator has to opt in explicitly to
+# running them as the application's own user. Grades come back through
+# grade_solution, AUTOGRADE_BATCH_SIZE at a time inside one storage batch.
+GRADER_DRIVER = '''import importlib, json, sys
+sys.path[:0] = json.loads(sys.argv[3])
+result = getattr(importlib.import_module(sys.argv[1]), sys.argv[2])(sys.stdin.read())
+print(json.dumps(list(result) if isinstance(result, tuple) else [result, None]))
+'''  # Runs a doctor's grader function on the content read from stdin, in a child interpreter
+
+
+class GradingTimeout(Exception):
+    pass
+
+
+grader = None  # (test spec, timeout, solution account) in a grading worker process
+solution_account = None  # (uid, gid) that runs the solutions of test cases, see sandbox_solutions
+unsandboxed_solutions = False  # Whether test cases may run as this process's user without an account
+
+
+def sandbox_solutions(account=None, unsandboxed=False):
+    # Solutions of 'cases' specs run as account, which needs root to switch to; without an account they are
+    # refused unless unsandboxed, when they run with every permission of the application's user
+    global solution_account, unsandboxed_solutions
+    solution_account = None
+    if account is not None:
+        if pwd is None:
+            raise ValueError("Solutions can only run as another user on Unix.")
+        try:
+            entry = pwd.getpwnam(account)
+        except KeyError:
+            raise ValueError(f"Unknown user '{account}'.") from None
+        if entry.pw_uid == 0 or entry.pw_uid == os.geteuid():
+            raise ValueError(f"'{account}' is privileged or runs the application; solutions need a user of their own.")
+        if os.geteuid() != 0:
+            raise ValueError("Only root can run solutions as another user.")
+        solution_account = (entry.pw_uid, entry.pw_gid)
+    unsandboxed_solutions = unsandboxed
+
+
+def start_grader(test_spec, directory, timeout, account):
+    global grader
+    grader = (test_spec, timeout, account)
+    blobs.open(directory)
+
+
+def limit_solution():
+    # In the child before it runs a solution: writing to any file fails instead of ending the process.
+    # Only a size limit: creating, truncating or removing files is up to the account it runs as.
+    signal.signal(signal.SIGXFSZ, signal.SIG_IGN)
+    resource.setrlimit(resource.RLIMIT_FSIZE, (0, 0))
+
+
+def run_child(args, stdin, deadline, directory, limited=True, account=None):
+    # Runs an isolated interpreter (no environment, user site or bytecode writes) in its own process
+    # group, as the (uid, gid) account if given; returns (exit status, stdout), or raises GradingTimeout
+    # once the deadline has passed
+    timeout = deadline - time.monotonic()
+    if timeout <= 0:
+        raise GradingTimeout
+    switch = {} if account is None else {'user': account[0], 'group': account[1], 'extra_groups': []}
+    process = subprocess.Popen([sys.executable, '-I', '-B', *args], cwd=directory, env={}, text=True,
+                               stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                               start_new_session=hasattr(os, 'killpg'),
+                               preexec_fn=limit_solution if limited and resource is not None else None, **switch)
+    try:
+        output, _ = process.communicate(stdin, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        if hasattr(os, 'killpg'):
+            os.killpg(process.pid, signal.SIGKILL)
+        else:
+            process.kill()
+        process.communicate()
+        raise GradingTimeout from None
+    return process.returncode, output
+
+
+def run_tests(test_spec, content, deadline, account=None):
+    # Returns (grade, comments) for one solution; test cases run as the (uid, gid) account if given
+    kind, value = next(iter(test_spec.items()))
+    if kind == 'answer':
+        if content.split() == value.split():
+            return 100, None
+        return 0, "Wrong answer."
+    with tempfile.TemporaryDirectory() as directory:
+        if kind == 'cases':
+            filename = os.path.join(directory, 'solution.py')
+            with open(filename, 'w') as f:
+                f.write(content)
+            if account is not None:
+                # The account can read the solution but write nothing next to it
+                os.chmod(filename, 0o444)
+                os.chmod(directory, 0o711)
+            passed = 0
+            for case in value:
+                # A solution that crashes fails the case
+                status, output = run_child(['solution.py'], case.get('input', ''), deadline, directory,
+                                           account=account)
+                passed += status == 0 and output.split() == case['output'].split()
+            grade = 100 * passed / len(value)
+            return round(grade, 2), f"Passed {passed} of {len(value)} tests."
+        # The doctor's grader is trusted code, but it still gets the deadline and a process of its own
+        module, function = value.split(':')
+        status, output = run_child(['-c', GRADER_DRIVER, module, function, json.dumps([os.getcwd(), *sys.path])],
+                                   content, deadline, directory, limited=False)
+        if status != 0:
+            raise RuntimeError(f"The grader exited with status {status}.")
+        grade, comments = json.loads(output.splitlines()[-1])
+        return grade, None if comments is None else str(comments)
+
+
+def grade_job(job):
+    # Runs in a worker: returns (student_id, digest, grade, comments), with a None grade and the error if it failed
+    student_id, digest = job
+    test_spec, timeout, account = grader
+    try:
+        return (student_id, digest, *run_tests(test_spec, blobs.read(digest), time.monotonic() + timeout, account))
+    except GradingTimeout:
+        return student_id, digest, 0, f"Timed out after {timeout} seconds."
+    except Exception as error:
+        return student_id, digest, None, f"{type(error).__name__}: {error}"
+
+
+def grading_pool(assignment, workers, timeout):
+    return concurrent.futures.ProcessPoolExecutor(workers, initializer=start_grader,
+                                                  initargs=(assignment.test_spec, blobs.directory, timeout,
+                                                            solution_account))
+
+
+def write_grades(users, assignment, results):
+    # Returns how many of the results were written as grades
+    graded = 0
+    with storage.batch() if storage is not None else contextlib.nullcontext():
+        for student_id, digest, grade, comments in results:
+            solution = assignment.solutions.get(student_id)
+            if grade is None or solution is None or solution.digest != digest or solution.grade is not None:
+                continue
+            try:
+                assignment.grade_solution(users[student_id], grade, comments)
+                graded += 1
+            except ValueError:
+                pass  # The grader returned something that is not a grade
+    return graded
+
+
+def autograde(users, assignment, workers=None, timeout=AUTOGRADE_TIMEOUT, progress=None):
+    # Grades every ungraded solution; returns (graded, failed, seconds). progress(done, total, seconds) is
+    # called after each batch, and solutions resubmitted while they were being graded are left for the next run.
+    if assignment.test_spec is None:
+        raise ValueError("The assignment has no test spec.")
+    if 'cases' in assignment.test_spec and solution_account is None and not unsandboxed_solutions:
+        raise ValueError("Test cases run students' code: start the program with --autograde-user ACCOUNT, "
+                         "or with --unsandboxed-autograde to run it as this user.")
+    pending = [(student_id, solution.digest) for student_id, solution in assignment.solutions.items()
+               if solution.grade is None]
+    graded = done = 0
+    start = time.perf_counter()
+    while done < len(pending):
+        batch = []
+        broken = False
+        with grading_pool(assignment, workers, timeout) as executor:
+            try:
+                for result in executor.map(grade_job, pending[done:], chunksize=AUTOGRADE_CHUNK_SIZE):
+                    batch.append(result)
+                    if len(batch) == AUTOGRADE_BATCH_SIZE:
+                        graded += write_grades(users, assignment, batch)
+                        done += len(batch)
+                        batch = []
+                        if progress is not None:
+                            progress(done, len(pending), time.perf_counter() - start)
+            except concurrent.futures.process.BrokenProcessPool:
+                broken = True  # A worker died (e.g. out of memory), taking the results of the whole chunk with it
+        graded += write_grades(users, assignment, batch)
+        done += len(batch)
+        if broken:
+            # The first solution without a result either killed the worker or ran next to the one that did.
+            # Graded on its own it succeeds or is left ungraded, and a fresh pool goes on with the rest.
+            with grading_pool(assignment, 1, timeout) as executor:
+                try:
+                    graded += write_grades(users, assignment, [executor.submit(grade_job, pending[done]).result()])
+                except concurrent.futures.process.BrokenProcessPool:
+                    pass
+            done += 1
+        if progress is not None:
+            progress(done, len(pending), time.perf_counter() - start)
+    return graded, len(pending) - graded, time.perf_counter() - start
+
+
+# Opt-in instrumentation of the hot paths, turned on by --profile or by setting
+# EMS_PROFILE. Nothing is wrapped until enable() runs, so a normal run calls the
+# plain functions; once enabled, every call to one of instrumented_functions() is
+# counted and its latency added to a histogram of power-of-two microsecond
+# buckets. A single menu action can also be run under cProfile.
+def instrumented_functions():
+    # (namespace, name) pairs; the namespace is a class, or this module's globals for a plain function
+    module = globals()
+    return ((User, 'sign_in'), (UserDirectory, 'authenticate'), (module, 'load_data'), (module, 'save_data'),
+            (module, 'open_storage'), (Course, 'get_student_grade'), (Student, 'view_grades'),
+            (Doctor, 'view_course'), (Student, 'view_course'), (Assignment, 'submit_solution'),
+            (Storage, 'student_grades'), (SqliteStorage, 'student_grades'), (Storage, 'assignment_grades'),
+            (SqliteStorage, 'assignment_grades'))
+
+
+class CallStats:
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.seconds = 0.0
+        self.slowest = 0.0
+        self.histogram = [0] * LATENCY_BUCKETS  # Bucket i counts the calls under 2**i microseconds not in bucket i - 1
+
+    def add(self, elapsed, failed):
+        self.calls += 1
+        self.errors += failed
+        self.seconds += elapsed
+        self.slowest = max(self.slowest, elapsed)
+        self.histogram[min(int(elapsed * 1e6).bit_length(), LATENCY_BUCKETS - 1)] += 1
+
+    def quantile(self, q):
+        # Upper bound of the bucket holding the q-quantile, in microseconds, and never above the slowest call
+        seen = 0
+        for i, count in enumerate(self.histogram):
+            seen += count
+            if seen >= q * self.calls:
+                return min(2 ** i, self.slowest * 1e6)
+        return self.slowest * 1e6
+
+    def to_dict(self):
+        return {'calls': self.calls, 'errors': self.errors, 'total_seconds': self.seconds,
+                'mean_us': self.seconds / self.calls * 1e6 if self.calls else 0.0,
+                'p50_us': self.quantile(0.5), 'p95_us': self.quantile(0.95), 'p99_us': self.quantile(0.99),
+                'max_us': self.slowest * 1e6,
+                'histogram_us': {f'<{2 ** i}' if i < LATENCY_BUCKETS - 1 else f'>={2 ** (i - 1)}': count
+                                 for i, count in enumerate(self.histogram) if count}}
+
+
+def object_counts(users):
+    # Domain objects in memory; assignments and solutions are only counted in the courses that are loaded
+    loaded = [course for course in list(catalog.courses.values()) if course._assignments is not None]
+    kinds = collections.Counter(type(user).__name__ for user in users.values()) if users is not None else {}
+    return {'doctors': kinds.get('Doctor', 0), 'students': kinds.get('Student', 0),
+            'courses': len(catalog.courses), 'loaded_courses': len(loaded),
+            'assignments': sum(len(course._assignments) for course in loaded),
+            'solutions': sum(len(assignment.solutions) for course in loaded for assignment in course._assignments),
+            'sessions': len(sessions.tokens), 'cached_signatures': len(signatures.signatures)}
+
+
+class Instruments:
+    def __init__(self):
+        self.enabled = False
+        self.stats = {}       # label -> CallStats
+        self.originals = []   # (namespace, name, function) replaced by enable()
+        self.lock = threading.Lock()  # The service calls the wrappers from its worker threads
+        self.started = None
+        self.capture_requested = None  # File to dump the next profiled action to ('' to only print it)
+        self.profiler = None
+
+    def enable(self):
+        if self.enabled:
+            return
+        for namespace, name in instrumented_functions():
+            if isinstance(namespace, dict):
+                function, label = namespace[name], name
+                namespace[name] = self.wrap(label, function)
+            else:
+                function, label = namespace.__dict__[name], f'{namespace.__name__}.{name}'
+                setattr(namespace, name, self.wrap(label, function))
+            self.originals.append((namespace, name, function))
+        self.enabled = True
+        self.started = time.perf_counter()
+
+    def disable(self):
+        for namespace, name, function in reversed(self.originals):
+            if isinstance(namespace, dict):
+                namespace[name] = function
+            else:
+                setattr(namespace, name, function)
+        self.originals.clear()
+        self.enabled = False
+
+    def reset(self):
+        with self.lock:
+            for stats in self.stats.values():
+                stats.__init__()
+            self.started = time.perf_counter()
+
+    def wrap(self, label, function):
+        stats = self.stats.setdefault(label, CallStats())
+        lock = self.lock
+        if inspect.isgeneratorfunction(function):
+            return self.wrap_generator(stats, function)
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            failed = True
+            start = time.perf_counter()
+            try:
+                result = function(*args, **kwargs)
+                failed = False
+                return result
+            finally:
+                elapsed = time.perf_counter() - start
+                with lock:
+                    stats.add(elapsed, failed)
+        return wrapper
+
+    def wrap_generator(self, stats, function):
+        # A generator is one call lasting until it is exhausted, timed only while it produces its values
+        lock = self.lock
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            failed = False
+            elapsed = 0.0
+            iterator = function(*args, **kwargs)
+            try:
+                while True:
+                    start = time.perf_counter()
+                    try:
+                        value = next(iterator)
+                    except StopIteration:
+                        return
+                    except BaseException:
+                        failed = True
+                        raise
+                    finally:
+                        elapsed += time.perf_counter() - start
+                    yield value
+            finally:
+                iterator.close()
+                with lock:
+                    stats.add(elapsed, failed)
+        return wrapper
+
+    def report(self):
+        with self.lock:
+            functions = {label: stats.to_dict() for label, stats in self.stats.items()}
+        return {'seconds': time.perf_counter() - self.started if self.started is not None else 0.0,
+                'functions': functions, 'objects': object_counts(sessions.users)}
+
+    def print_report(self):
+        report = self.report()
+        print(f"Instrumented for {report['seconds']:.1f}s")
+        print(f"{'Function':<30} {'Calls':>8} {'Errors':>6} {'Total s':>9} {'Mean us':>10} {'p50 us':>9} "
+              f"{'p95 us':>9} {'p99 us':>9} {'Max us':>10}")
+        for label, stats in report['functions'].items():
+            if stats['calls']:
+                print(f"{label:<30} {stats['calls']:>8} {stats['errors']:>6} {stats['total_seconds']:>9.3f} "
+                      f"{stats['mean_us']:>10.1f} {stats['p50_us']:>9.0f} {stats['p95_us']:>9.0f} "
+                      f"{stats['p99_us']:>9.0f} {stats['max_us']:>10.0f}")
+        print("Objects: " + ", ".join(f"{name} {count}" for name, count in report['objects'].items()))
+
+    def export(self, filename):
+        with open(filename, 'w') as f:
+            json.dump(self.report(), f, indent=2)
+
+    def profile_next_action(self, filename=''):
+        self.capture_requested = filename
+
+    def next_action(self):
+        # Called before each menu is shown: ends a profiled action, or starts one that was asked for
+        if self.profiler is not None:
+            self.finish_capture()
+        elif self.capture_requested is not None:
+            self.profiler = cProfile.Profile()
+            globals()['input'] = self.unprofiled_input  # Time spent waiting at a prompt is not the action's
+            self.profiler.enable()
+
+    def unprofiled_input(self, prompt=''):
+        self.profiler.disable()
+        try:
+            return builtins.input(prompt)
+        finally:
+            self.profiler.enable()
+
+    def finish_capture(self):
+        if self.profiler is None:
+            return
+        self.profiler.disable()
+        globals().pop('input', None)
+        filename, self.capture_requested = self.capture_requested, None
+        profiler, self.profiler = self.profiler, None
+        pstats.Stats(profiler, stream=sys.stdout).sort_stats('cumulative').print_stats(PROFILE_TOP)
+        if filename:
+            profiler.dump_stats(filename)
+            print(f"Profile saved to {filename}.")
+
+
+instruments = Instruments()
+
+
+SERVICE_LINE_LIMIT = 16 * 1024 * 1024  # Longest request line, which bounds a submitted solution
+SERVICE_BACKLOG = 1024                 # Pending connections, for a whole class connecting at once
+
+
+# Service mode: the Doctor and Student operations as JSON lines over a local
+# TCP or Unix socket, one request and one response per line. sign_in returns a
+# session token: the connection keeps using it, and any request may pass it as
+# 'token' instead, from any connection, until it expires or is logged out.
+# Operations run in worker threads; the ones naming a course hold that course's
+# lock, so different courses are served in parallel while operations on one
+# course are applied one at a time.
+class Service:
+    def __init__(self, users):
+        self.users = users
+        self.course_locks = {}                 # course_code -> asyncio.Lock
+        self.directory_lock = asyncio.Lock()   # Sign-ups, which allocate user IDs
+
+    async def handle(self, reader, writer):
+        connection = {'token': None}
+        try:
+            async for line in reader:
+                response = await self.dispatch(connection, line)
+                writer.write(json.dumps(response).encode() + b'\n')
+                await writer.drain()
+        except (ConnectionError, ValueError):
+            pass  # Client went away, or sent a line over SERVICE_LINE_LIMIT
+        finally:
+            writer.close()
+
+    async def dispatch(self, connection, line):
+        request = {}
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError("A request must be a JSON object.")
+            op = request.get('op')
+            handler = getattr(self, f'op_{op}', None) if isinstance(op, str) else None
+            if handler is None:
+                raise ValueError(f"Unknown operation '{op}'.")
+            token = request.get('token', connection['token'])
+            session = {'user': sessions.resolve(token) if isinstance(token, str) else None, 'token': token}
+            lock = self.lock_for(op, request)
+            if lock is None:
+                result = await asyncio.to_thread(handler, session, request)
+            else:
+                async with lock:
+                    result = await asyncio.to_thread(self.run_locked, handler, session, request)
+            if 'token' not in request:
+                connection['token'] = session['token']  # Signed in or out on this connection
+            response = {'ok': True, 'result': result}
+        except (ValueError, KeyError, TypeError, IndexError) as error:
+            message = f"Missing field {error}." if isinstance(error, KeyError) else str(error)
+            response = {'ok': False, 'error': message}
+        except Exception as error:
+            # A failure of the server itself (a full disk, a database error): logged here, and the client
+            # still gets an answer and keeps its connection
+            print(f"Error in operation '{request.get('op')}':", file=sys.stderr)
+            traceback.print_exc()
+            response = {'ok': False, 'error': f"Internal error ({type(error).__name__}), the operation may not have completed."}
+        if 'id' in request:
+            response['id'] = request['id']
+        return response
+
+    def lock_for(self, op, request):
+        if op == 'sign_up':
+            return self.directory_lock
+        course_code = request.get('course_code')
+        if not isinstance(course_code, str) or (course_code not in catalog.courses and op != 'create_course'):
+            return None  # Read-only, or bound to fail on an unknown course
+        lock = self.course_locks.get(course_code)
+        if lock is None:
+            lock = self.course_locks[course_code] = asyncio.Lock()
+        return lock
+
+    def run_locked(self, handler, session, request):
+        # A course is pinned in the cache while an operation runs on it
+        course_code = request.get('course_code')
+        with catalog.lock:
+            catalog.in_use.add(course_code)
+        try:
+            return handler(session, request)
+        finally:
+            with catalog.lock:
+                catalog.in_use.discard(course_code)
+
+    @staticmethod
+    def text(request, name):
+        value = request[name]
+        if not isinstance(value, str):
+            raise ValueError(f"Field '{name}' must be a string.")
+        return value
+
+    def signed_in(self, session, kind=User):
+        user = session['user']
+        if user is None:
+            raise ValueError("Sign in first." if session['token'] is None else "Invalid or expired session, sign in again.")
+        if not isinstance(user, kind):
+            raise ValueError(f"Only a {kind.__name__.lower()} can do that.")
+        return user
+
+    def course_of(self, user, request):
+        course_code = request['course_code']
+        course = user.view_course(course_code)
+        if course is None:
+            raise ValueError(f"Course '{course_code}' is not one of your courses.")
+        return course
+
+    def assignment_of(self, course, request):
+        # Assignments are numbered from 1, as in the menus
+        number = request['assignment']
+        if not isinstance(number, int) or not 1 <= number <= len(course.assignments):
+            raise ValueError(f"Course '{course.course_code}' has no assignment {number}.")
+        return course.assignments[number - 1]
+
+    def op_sign_up(self, session, request):
+        text = self.text
+        kind = text(request, 'kind').lower()
+        if kind not in ('doctor', 'student'):
+            raise ValueError("Kind must be 'doctor' or 'student'.")
+        if not User.is_valid_email(text(request, 'email')):
+            raise ValueError("Invalid email format.")
+        user_class = Doctor if kind == 'doctor' else Student
+        user = user_class(self.users.next_user_id, text(request, 'username'), text(request, 'password'),
+                          text(request, 'full_name'), request['email'])
+        self.users.add(user)
+        return {'user_id': user.user_id}
+
+    def op_sign_in(self, session, request):
+        user = self.users.authenticate(self.text(request, 'username'), self.text(request, 'password'))
+        if user is None:
+            raise ValueError("Invalid credentials.")
+        session['token'] = sessions.issue(user)
+        return {'user_id': user.user_id, 'kind': type(user).__name__.lower(), 'full_name': user.full_name,
+                'token': session['token']}
+
+    def op_log_out(self, session, request):
+        self.signed_in(session)
+        sessions.revoke(session['token'])
+        session['token'] = None
+        storage.sync()
+
+    def op_list_courses(self, session, request):
+        return [{'course_code': course.course_code, 'course_name': course.course_name,
+                 'doctor': course.provided_by.full_name}
+                for course in storage.list_courses(self.signed_in(session))]
+
+    def op_available_courses(self, session, request):
+        return [{'course_code': course.course_code, 'course_name': course.course_name,
+                 'doctor': course.provided_by.full_name}
+                for course in storage.available_courses(self.signed_in(session, Student))]
+
+    def op_create_course(self, session, request):
+        self.signed_in(session, Doctor).create_course(self.text(request, 'course_name'), self.text(request, 'course_code'))
+
+    def op_register_course(self, session, request):
+        course = catalog.get(request['course_code'])
+        if course is None:
+            raise ValueError(f"No course with code '{request['course_code']}'.")
+        self.signed_in(session, Student).register_course(course)
+
+    def op_unregister_course(self, session, request):
+        student = self.signed_in(session, Student)
+        student.unregister_course(self.course_of(student, request))
+
+    def op_list_assignments(self, session, request):
+        course = self.course_of(self.signed_in(session), request)
+        return [{'assignment': assignment.index + 1, 'assignment_title': assignment.assignment_title,
+                 'description': assignment.description, 'deadline': assignment.deadline, 'due': assignment.due}
+                for assignment in course.assignments]
+
+    def op_upcoming_deadlines(self, session, request):
+        student = self.signed_in(session, Student)
+        limit = request.get('limit', 10)
+        if not isinstance(limit, int) or limit < 0:
+            raise ValueError("limit must be a non-negative integer.")
+        return [{'course_code': assignment.course.course_code, 'assignment': assignment.index + 1,
+                 'assignment_title': assignment.assignment_title, 'deadline': assignment.deadline, 'due': due,
+                 'submitted': student.user_id in assignment.solutions}
+                for due, assignment in student.upcoming_deadlines(limit)]
+
+    def op_add_assignment(self, session, request):
+        course = self.course_of(self.signed_in(session, Doctor), request)
+        assignment = course.add_assignment(self.text(request, 'assignment_title'), self.text(request, 'description'),
+                                           validate_deadline(self.text(request, 'deadline')))
+        return {'assignment': assignment.index + 1}
+
+    def op_submit_solution(self, session, request):
+        student = self.signed_in(session, Student)
+        assignment = self.assignment_of(self.course_of(student, request), request)
+        assignment.submit_solution(student, self.text(request, 'content'))
+
+    def op_grade_solution(self, session, request):
+        assignment = self.assignment_of(self.course_of(self.signed_in(session, Doctor), request), request)
+        student = self.users.get(request['student_id'])
+        if student is None or student.user_id not in assignment.solutions:
+            raise ValueError(f"No solution from student {request['student_id']}.")
+        comments = request.get('comments')
+        if comments is not None and not isinstance(comments, str):
+            raise ValueError("Field 'comments' must be a string.")
+        assignment.grade_solution(student, request['grade'], comments)
+
+    def op_view_grades(self, session, request):
+        return {course_code: {'assignments': num_assignments, 'total_grade': total_grade, 'total_possible': total_possible}
+                for course_code, (num_assignments, total_grade, total_possible)
+                in storage.student_grades(self.signed_in(session, Student)).items()}
+
+    def op_assignment_grades(self, session, request):
+        assignment = self.assignment_of(self.course_of(self.signed_in(session, Doctor), request), request)
+        count, mean, stddev = assignment.grade_stats()
+        return {'graded': count, 'mean': mean, 'stddev': stddev,
+                'solutions': [{'student_id': student_id, 'full_name': full_name, 'grade': grade, 'comments': comments}
+                              for student_id, full_name, grade, comments in storage.assignment_grades(assignment)]}
+
+    def op_similar_solutions(self, session, request):
+        assignment = self.assignment_of(self.course_of(self.signed_in(session, Doctor), request), request)
+        threshold = request.get('threshold', 0.8)
+        if not isinstance(threshold, (int, float)):
+            raise ValueError("threshold must be a number.")
+        return [{'similarity': similarity, 'student_id': student_id, 'other_student_id': other_id}
+                for similarity, student_id, other_id in assignment.similar_solutions(threshold)]
+
+    def op_query(self, session, request):
+        # One page of the user's courses, a course's assignments, or an assignment's solutions or grades
+        name = self.text(request, 'query')
+        if name not in QUERIES:
+            raise ValueError(f"Unknown query '{name}', choose from {', '.join(QUERIES)}.")
+        if name == 'courses':
+            source = self.signed_in(session)
+        else:
+            course = self.course_of(self.signed_in(session, Doctor if name in ('solutions', 'grades') else User), request)
+            source = course if name == 'assignments' else self.assignment_of(course, request)
+        sort = request.get('sort')
+        cursor = request.get('cursor')
+        grade_below = request.get('grade_below')
+        if sort is not None and not isinstance(sort, str):
+            raise ValueError("sort must be a column name.")
+        if cursor is not None and not isinstance(cursor, list):
+            raise ValueError("cursor must be the cursor returned with the previous page.")
+        if grade_below is not None and not isinstance(grade_below, (int, float)):
+            raise ValueError("grade_below must be a number.")
+        page_size = request.get('page_size', PAGE_SIZE)
+        if isinstance(page_size, int) and page_size > MAX_PAGE_SIZE:
+            raise ValueError(f"page_size must be at most {MAX_PAGE_SIZE}.")
+        rows, cursor = query_page(self.users, name, source, sort, bool(request.get('descending')), cursor, page_size,
+                                  ungraded=bool(request.get('ungraded')), grade_below=grade_below)
+        fields = QUERIES[name][1]
+        return {'rows': [dict(zip(fields, row)) for row in rows], 'cursor': cursor}
+
+    def op_profile_report(self, session, request):
+        self.signed_in(session, Doctor)
+        if not instruments.enabled:
+            raise ValueError(f"Profiling is off; start the service with --profile or {PROFILE_ENV}=1.")
+        return instruments.report()
+
+
+async def serve(users, address):
+    # ADDRESS is host:port for TCP, anything else is the path of a Unix socket
+    service = Service(users)
+    host, _, port = address.rpartition(':')
+    if host and port.isdigit():
+        server = await asyncio.start_server(service.handle, host, int(port), limit=SERVICE_LINE_LIMIT,
+                                            backlog=SERVICE_BACKLOG)
+    else:
+        server = await asyncio.start_unix_server(service.handle, address, limit=SERVICE_LINE_LIMIT,
+                                                 backlog=SERVICE_BACKLOG)
+    # Stop on Ctrl-C or kill, so the caller can compact the data before exiting
+    stopped = asyncio.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        try:
+            asyncio.get_running_loop().add_signal_handler(signum, stopped.set)
+        except NotImplementedError:
+            pass  # Windows: Ctrl-C still ends asyncio.run with KeyboardInterrupt
+    print(f"Serving on {address}", flush=True)
+    async with server:
+        await stopped.wait()
+
+
+def print_solution_content(solution):
+    # Streamed from the blob store, so a large body is never held in memory as a whole
+    print("Content: ", end='')
+    sys.stdout.writelines(blobs.stream(solution.digest))
+    print()
+
+
+QUERY_OPTIONS_PROMPT = ("Filter and sort ('ungraded', 'below N', 'sort COLUMN' with {columns}, 'desc'; "
+                        "empty for all): ")
+
+
+def parse_query_options(text):
+    # 'ungraded', 'below N', 'sort COLUMN' and 'desc' in any order, as typed at the listing prompts
+    options = {}
+    words = text.lower().split()
+    while words:
+        word = words.pop(0)
+        if word == 'ungraded':
+            options['ungraded'] = True
+        elif word == 'desc':
+            options['descending'] = True
+        elif word in ('below', 'sort') and words:
+            value = words.pop(0)
+            if word == 'sort':
+                options['sort'] = value
+                continue
+            try:
+                options['grade_below'] = float(value)
+            except ValueError:
+                raise ValueError(f"'{value}' is not a grade.") from None
+        else:
+            raise ValueError(f"Unknown option '{word}'.")
+    return options
+
+
+def browse(pages):
+    # The rows of a query's pages, asking before each page after the first
+    for number, rows in enumerate(pages):
+        if number and input("Enter for the next page, q to stop: ").strip().lower() == 'q':
+            return
+        yield from rows
+
+
+def profiling_menu():
+    print("Profiling")
+    print("1. Show Report")
+    print("2. Export Report")
+    print("3. Profile Next Action")
+    print("4. Reset Counters")
+    print("5. Back")
+    choice = input("Enter your choice: ")
+    if choice == "1":
+        instruments.print_report()
+    elif choice == "2":
+        report_filename = input("Report file (JSON): ")
+        try:
+            instruments.export(report_filename)
+            print(f"Report exported to {report_filename}.")
+        except OSError as e:
+            print(e)
+    elif choice == "3":
+        instruments.profile_next_action(input("Save the profile to (empty to only print it): "))
+        print("The next menu action will be profiled.")
+    elif choice == "4":
+        instruments.reset()
+        print("Counters reset.")
+    elif choice != "5":
+        print("Invalid choice. Please try again.")
+
+
+def main(filename='ems_data.json', sessions_filename=None, workers=None):
+    users = open_storage(filename, sessions_filename)
+    current_user = None
+    token = None
 
     while True:
+        instruments.next_action()
         if current_user is None:
             print("Welcome to the Educational Management System")
             print("1. Sign In")
             print("2. Sign Up")
             print("3. Exit")
+            if instruments.enabled:
+                print("P. Profiling")
 
             choice = input("Enter your choice: ")
             if choice == "1":
                 username = input("Username: ")
                 password = input("Password: ")
-                for user in users.values():
-                    if user.sign_in(username, password):
-                        current_user = user
-                        print("Signed in successfully.")
-                        break
+                user = users.authenticate(username, password)
+                if user:
+                    current_user = user
+                    token = sessions.issue(user)
+                    print("Signed in successfully.")
                 else:
                     print("Invalid credentials. Please try again.")
             elif choice == "2":
@@ -259,8 +3073,11 @@ def main():
                     else:
                         break
 
-                user_id = len(users) + 1
+                user_id = users.next_user_id
                 username = input("Username: ")
+                if users.find_by_username(username):
+                    print("Username already taken. Please try again.")
+                    continue
                 password = input("Password: ")
                 full_name = input("Full Name: ")
                 email = input("Email: ")
@@ -268,18 +3085,23 @@ def main():
                 if not User.is_valid_email(email):
                     print("Invalid email format. Please try again.")
                     continue
+                if users.find_by_email(email):
+                    print("An account with this email already exists. Please try again.")
+                    continue
 
                 if user_type.lower() == "doctor":
                     user = Doctor(user_id, username, password, full_name, email)
                 elif user_type.lower() == "student":
                     user = Student(user_id, username, password, full_name, email)
 
-                users[user_id] = user
+                users.add(user)
                 print(f"Sign up successful. Your user ID is {user_id}. You can now sign in.")
 
             elif choice == "3":
-                save_data(users)
+                storage.compact(users)
                 break
+            elif choice.upper() == "P" and instruments.enabled:
+                profiling_menu()
             else:
                 print("Invalid choice. Please try again.")
         else:
@@ -289,17 +3111,21 @@ def main():
                 print("2. Create Course")
                 print("3. View Course")
                 print("4. Log Out")
+                if instruments.enabled:
+                    print("P. Profiling")
 
                 choice = input("Enter your choice: ")
                 if choice == "1":
-                    courses = current_user.list_courses()
-                    for course in courses:
-                        print(f"{course.course_name} ({course.course_code})")
+                    for course_code, course_name, _, _ in browse(query_pages(users, 'courses', current_user)):
+                        print(f"{course_name} ({course_code})")
                 elif choice == "2":
                     course_name = input("Course Name: ")
                     course_code = input("Course Code: ")
-                    current_user.create_course(course_name, course_code)
-                    print("Course created successfully.")
+                    try:
+                        current_user.create_course(course_name, course_code)
+                        print("Course created successfully.")
+                    except ValueError as e:
+                        print(e)
                 elif choice == "3":
                     course_code = input("Course Code: ")
                     course = current_user.view_course(course_code)
@@ -308,18 +3134,21 @@ def main():
                         print("1. List Assignments")
                         print("2. Create Assignment")
                         print("3. View Assignment")
-                        print("4. Back")
+                        print("4. Grades Summary")
+                        print("5. Back")
                         sub_choice = input("Enter your choice: ")
                         if sub_choice == "1":
-                            assignments = course.list_assignments()
-                            for idx, assignment in enumerate(assignments, 1):
-                                print(f"{idx}. {assignment.assignment_title}")
+                            for number, assignment_title, *_ in browse(query_pages(users, 'assignments', course)):
+                                print(f"{number}. {assignment_title}")
                         elif sub_choice == "2":
                             assignment_title = input("Assignment Title: ")
                             description = input("Description: ")
-                            deadline = input("Deadline: ")
-                            course.add_assignment(assignment_title, description, deadline)
-                            print("Assignment created successfully.")
+                            deadline = input("Deadline (YYYY-MM-DD or YYYY-MM-DD HH:MM): ")
+                            try:
+                                course.add_assignment(assignment_title, description, validate_deadline(deadline))
+                                print("Assignment created successfully.")
+                            except ValueError as e:
+                                print(e)
                         elif sub_choice == "3":
                             assignments = course.list_assignments()
                             for idx, assignment in enumerate(assignments, 1):
@@ -333,32 +3162,55 @@ def main():
                                     print("2. Show Grades Report")
                                     print("3. List Solutions")
                                     print("4. View Solution")
-                                    print("5. Back")
+                                    print("5. Find Similar Solutions")
+                                    print("6. Set Test Spec")
+                                    print("7. Autograde Pending Solutions")
+                                    print("8. Export Report")
+                                    print("9. Back")
                                     assign_choice = input("Enter your choice: ")
 
                                     if assign_choice == "1":
                                         print(f"Title: {assignment.assignment_title}")
                                         print(f"Description: {assignment.description}")
                                         print(f"Deadline: {assignment.deadline}")
+                                        print(f"Submitted on time: {assignment.on_time_count} - "
+                                              f"Late: {assignment.late_count}")
                                     elif assign_choice == "2":
-                                        for student_id, solution in assignment.solutions.items():
-                                            student = users[student_id]
-                                            print(f"Student: {student.full_name} (ID: {student.user_id})")
-                                            print(f"Grade: {solution['grade']}")
-                                            print(f"Comments: {solution['comments']}")
+                                        graded, mean, stddev = assignment.grade_stats()
+                                        if graded:
+                                            print(f"Submissions: {len(assignment.solutions)} - Graded: {graded} - "
+                                                  f"Mean: {mean:.1f} - Std Dev: {stddev:.1f}")
+                                        options = input(QUERY_OPTIONS_PROMPT.format(columns=', '.join(QUERIES['grades'][1])))
+                                        try:
+                                            for student_id, full_name, grade, comments in browse(query_pages(
+                                                    users, 'grades', assignment, **parse_query_options(options))):
+                                                print(f"Student: {full_name} (ID: {student_id})")
+                                                print(f"Grade: {grade}")
+                                                print(f"Comments: {comments}")
+                                        except ValueError as e:
+                                            print(e)
                                     elif assign_choice == "3":
-                                        for student_id, solution in assignment.solutions.items():
-                                            student = users[student_id]
-                                            print(f"Student: {student.full_name} (ID: {student.user_id})")
+                                        options = input(QUERY_OPTIONS_PROMPT.format(columns=', '.join(QUERIES['solutions'][1])))
+                                        try:
+                                            for student_id, full_name, submitted_at, late, _ in browse(query_pages(
+                                                    users, 'solutions', assignment, **parse_query_options(options))):
+                                                submitted = ""
+                                                if submitted_at is not None:
+                                                    submitted = f" - Submitted: {format_time(submitted_at)}"
+                                                    if late:
+                                                        submitted += " (late)"
+                                                print(f"Student: {full_name} (ID: {student_id}){submitted}")
+                                        except ValueError as e:
+                                            print(e)
                                     elif assign_choice == "4":
                                         student_id = int(input("Enter Student ID: "))
                                         if student_id in assignment.solutions:
                                             solution = assignment.solutions[student_id]
                                             student = users[student_id]
                                             print(f"Student: {student.full_name} (ID: {student.user_id})")
-                                            print(f"Content: {solution['content']}")
-                                            print(f"Grade: {solution['grade']}")
-                                            print(f"Comments: {solution['comments']}")
+                                            print_solution_content(solution)
+                                            print(f"Grade: {solution.grade}")
+                                            print(f"Comments: {solution.comments}")
                                             while True:
                                                 print("1. Show Info")
                                                 print("2. Set Grade")
@@ -367,16 +3219,19 @@ def main():
                                                 sol_choice = input("Enter your choice: ")
 
                                                 if sol_choice == "1":
-                                                    print(f"Content: {solution['content']}")
-                                                    print(f"Grade: {solution['grade']}")
-                                                    print(f"Comments: {solution['comments']}")
+                                                    print_solution_content(solution)
+                                                    print(f"Grade: {solution.grade}")
+                                                    print(f"Comments: {solution.comments}")
                                                 elif sol_choice == "2":
                                                     grade = input("Enter Grade: ")
-                                                    solution['grade'] = grade
-                                                    print("Grade updated successfully.")
+                                                    try:
+                                                        assignment.grade_solution(student, grade, solution.comments)
+                                                        print("Grade updated successfully.")
+                                                    except ValueError as e:
+                                                        print(e)
                                                 elif sol_choice == "3":
                                                     comment = input("Enter Comment: ")
-                                                    solution['comments'] = comment
+                                                    assignment.grade_solution(student, solution.grade, comment)
                                                     print("Comment updated successfully.")
                                                 elif sol_choice == "4":
                                                     break
@@ -385,12 +3240,71 @@ def main():
                                         else:
                                             print("Invalid Student ID.")
                                     elif assign_choice == "5":
+                                        threshold = input("Minimum similarity in percent (default 80): ") or "80"
+                                        try:
+                                            pairs = assignment.similar_solutions(float(threshold) / 100)
+                                        except ValueError:
+                                            print("Similarity threshold must be between 0 and 100%.")
+                                            continue
+                                        for similarity, student_id, other_id in pairs:
+                                            print(f"{similarity:.0%} - {users[student_id].full_name} (ID: {student_id}) "
+                                                  f"and {users[other_id].full_name} (ID: {other_id})")
+                                        if not pairs:
+                                            print("No similar solutions found.")
+                                    elif assign_choice == "6":
+                                        spec_filename = input("Test spec file (JSON, empty to remove): ")
+                                        try:
+                                            test_spec = None
+                                            if spec_filename:
+                                                with open(spec_filename, 'r') as f:
+                                                    test_spec = json.load(f)
+                                            assignment.set_test_spec(test_spec)
+                                            print("Test spec updated successfully.")
+                                        except (OSError, ValueError) as e:
+                                            print(e)
+                                    elif assign_choice == "7":
+                                        try:
+                                            graded, failed, seconds = autograde(
+                                                users, assignment, workers,
+                                                progress=lambda done, total, seconds: print(
+                                                    f"{done}/{total} solutions checked ({done / seconds:.0f}/s)"))
+                                            print(f"Graded {graded} solutions in {seconds:.1f}s, {failed} left ungraded.")
+                                        except ValueError as e:
+                                            print(e)
+                                    elif assign_choice == "8":
+                                        report = input("Report (solutions or grades): ").strip().lower()
+                                        if report not in ('solutions', 'grades'):
+                                            print("Invalid report. Please enter either 'solutions' or 'grades'.")
+                                            continue
+                                        options = input(QUERY_OPTIONS_PROMPT.format(columns=', '.join(QUERIES[report][1])))
+                                        report_filename = input("Export to (.csv or .jsonl): ")
+                                        try:
+                                            count = export_query(users, report, assignment, report_filename,
+                                                                 **parse_query_options(options))
+                                            print(f"Exported {count} rows to {report_filename}.")
+                                        except (OSError, ValueError) as e:
+                                            print(e)
+                                    elif assign_choice == "9":
                                         break
                                     else:
                                         print("Invalid choice. Please try again.")
                             else:
                                 print("Invalid assignment number.")
-                        
+                        elif sub_choice == "4":
+                            gradebook = course.gradebook()
+                            for title, submissions, graded, mean, stddev, points in gradebook.assignment_stats():
+                                if graded:
+                                    print(f"{title} - Submissions: {submissions} - Graded: {graded} - Mean: {mean:.1f} - "
+                                          f"Std Dev: {stddev:.1f} - Median: {points[50]:.1f} - "
+                                          f"Quartiles: {points[25]:.1f}/{points[75]:.1f}")
+                                else:
+                                    print(f"{title} - Submissions: {submissions} - Graded: 0")
+                            print("Grade distribution: " + " ".join(
+                                f"{10 * i}-{10 * i + 9 if i < 9 else 100}: {count}"
+                                for i, count in enumerate(gradebook.histogram())))
+                            for rank, student_id, total_grade, total_possible in gradebook.ranking():
+                                print(f"{rank}. {users[student_id].full_name} (ID: {student_id}) - "
+                                      f"Grade: {total_grade:g}/{total_possible}")
                         elif sub_choice == "5":
                             continue
                         else:
@@ -398,8 +3312,11 @@ def main():
                     else:
                         print("Course not found.")
                 elif choice == "4":
-                    current_user.log_out()
-                    current_user = None
+                    current_user.log_out(token)
+                    current_user = token = None
+                    storage.sync()
+                elif choice.upper() == "P" and instruments.enabled:
+                    profiling_menu()
                 else:
                     print("Invalid choice. Please try again.")
             elif isinstance(current_user, Student):
@@ -408,19 +3325,19 @@ def main():
                 print("2. List My Courses")
                 print("3. View Course")
                 print("4. Grades Report")
-                print("5. Log Out")
+                print("5. Upcoming Deadlines")
+                print("6. Log Out")
+                if instruments.enabled:
+                    print("P. Profiling")
 
                 choice = input("Enter your choice: ")
                 if choice == "1":
                     print("Available Courses:")
-                    available_courses = []
-                    for user in users.values():
-                        if isinstance(user, Doctor):
-                            for course in user.list_courses():
-                                if course not in current_user.courses_registered:
-                                    available_courses.append(course)
-                                    print(f"{len(available_courses)}. {course.course_name} ({course.course_code}) - Provided by Doctor {course.provided_by.full_name}")
-                    
+                    available_courses = storage.available_courses(current_user)
+                    for idx, course in enumerate(available_courses, 1):
+                        print(f"{idx}. {course.course_name} ({course.course_code}) - Provided by Doctor {course.provided_by.full_name}")
+
+
                     if available_courses:
                         course_idx = int(input("Enter the number of the course to register: ")) - 1
                         if 0 <= course_idx < len(available_courses):
@@ -431,9 +3348,8 @@ def main():
                     else:
                         print("No available courses to register.")
                 elif choice == "2":
-                    courses = current_user.list_courses()
-                    for course in courses:
-                        print(f"{course.course_name} ({course.course_code}) - Provided by: {course.provided_by.full_name}")
+                    for course_code, course_name, doctor, _ in browse(query_pages(users, 'courses', current_user)):
+                        print(f"{course_name} ({course_code}) - Provided by: {doctor}")
                 elif choice == "3":
                     course_code = input("Course Code: ")
                     course = current_user.view_course(course_code)
@@ -443,7 +3359,7 @@ def main():
                         for idx, assignment in enumerate(course.list_assignments(), 1):
                             submission = assignment.get_student_grade(current_user)
                             status = "Submitted" if submission else "Not Submitted"
-                            grade = submission['grade'] if submission else "N/A"
+                            grade = submission.grade if submission else "N/A"
                             print(f"{idx}. {assignment.assignment_title} - {status} - Grade: {grade}")
                         
                         print ("Options :")
@@ -467,8 +3383,7 @@ def main():
                             else:
                                 print("Invalid assignment number.")
                         elif sub_choice == "2":
-                            current_user.courses_registered.remove(course)
-                            course.remove_student(current_user)
+                            current_user.unregister_course(course)
                             print("Unregistered from course successfully.")
                         elif sub_choice == "3":
                             continue
@@ -477,16 +3392,84 @@ def main():
                     else:
                         print("Course not found.")
                 elif choice == "4":
-                    grades_report = current_user.view_grades()
+                    grades_report = storage.student_grades(current_user)
                     for course_code, grades in grades_report.items():
                         num_assignments, total_grade, total_possible = grades
                         print(f"Course Code: {course_code} - Total Assignments: {num_assignments} - Grade: {total_grade}/{total_possible}")
                 elif choice == "5":
-                    current_user.log_out()
-                    current_user = None
+                    deadlines = current_user.upcoming_deadlines()
+                    for due, assignment in deadlines:
+                        status = "Submitted" if current_user.user_id in assignment.solutions else "Not Submitted"
+                        print(f"{format_time(due)} - {assignment.course.course_code} - {assignment.assignment_title} - "
+                              f"{status}")
+                    if not deadlines:
+                        print("No upcoming deadlines.")
+                elif choice == "6":
+                    current_user.log_out(token)
+                    current_user = token = None
+                    storage.sync()
+                elif choice.upper() == "P" and instruments.enabled:
+                    profiling_menu()
                 else:
                     print("Invalid choice. Please try again.")
+    instruments.finish_capture()
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Educational Management System")
+    parser.add_argument('--data', default='ems_data.json', help="data file; .db/.sqlite use the SQLite backend (default: ems_data.json)")
+    parser.add_argument('--compact', action='store_true', help="fold the journal into a fresh snapshot and exit")
+    parser.add_argument('--migrate', metavar='TARGET', help="copy the data into TARGET (e.g. ems_data.db) and exit")
+    parser.add_argument('--import', dest='imports', nargs=2, action='append', metavar=('KIND', 'FILE'),
+                        help=f"import a CSV or .jsonl file of {', '.join(BULK_KINDS)} and exit; may be repeated")
+    parser.add_argument('--export', dest='exports', nargs=2, action='append', metavar=('KIND', 'FILE'),
+                        help="export the same kinds of rows to a CSV or .jsonl file and exit; may be repeated")
+    parser.add_argument('--sessions', metavar='FILE',
+                        help="keep session tokens in FILE so they stay valid across restarts")
+    parser.add_argument('--serve', metavar='ADDRESS',
+                        help="serve the operations as JSON lines on host:port or a Unix socket path until interrupted")
+    parser.add_argument('--batch-size', type=int, default=BULK_BATCH_SIZE,
+                        help=f"imported rows made durable together (default: {BULK_BATCH_SIZE})")
+    parser.add_argument('--workers', type=int, help="autograding processes (default: one per CPU)")
+    parser.add_argument('--autograde-user', metavar='ACCOUNT',
+                        help="unprivileged user that runs solutions against test cases; needs root and no access to the data")
+    parser.add_argument('--unsandboxed-autograde', action='store_true',
+                        help="run solutions against test cases as this user, with access to the data; trusted code only")
+    parser.add_argument('--profile', action='store_true',
+                        help=f"count calls and time the hot paths, with a Profiling menu (also set by {PROFILE_ENV}=1)")
+    parser.add_argument('--profile-output', metavar='FILE', help="with profiling on, write its report as JSON on exit")
+    args = parser.parse_args()
+    try:
+        sandbox_solutions(args.autograde_user, args.unsandboxed_autograde)
+    except ValueError as error:
+        parser.error(str(error))
+    if args.profile or args.profile_output or os.environ.get(PROFILE_ENV, '') not in ('', '0'):
+        instruments.enable()
+        if args.profile_output:
+            atexit.register(instruments.export, args.profile_output)
+    for kind, _ in (args.imports or []) + (args.exports or []):
+        if kind not in BULK_KINDS:
+            parser.error(f"unknown kind '{kind}' (choose from {', '.join(BULK_KINDS)})")
+    if args.imports or args.exports:
+        users = open_storage(args.data)
+        for kind, filename in args.imports or []:
+            imported, rejected = import_file(users, kind, filename, args.batch_size)
+            print(f"Imported {imported} {kind} from {filename}, rejected {rejected}.")
+        if args.imports:
+            storage.compact(users)
+        for kind, filename in args.exports or []:
+            print(f"Exported {export_file(users, kind, filename)} {kind} to {filename}.")
+    elif args.serve:
+        users = open_storage(args.data, args.sessions)
+        try:
+            asyncio.run(serve(users, args.serve))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            storage.compact(users)
+    elif args.compact:
+        storage_for(args.data).compact(load_data(args.data))
+    elif args.migrate:
+        migrate_data(args.data, args.migrate)
+    else:
+        main(args.data, args.sessions, args.workers)
\ No newline at end of file
@@ -0,0 +1,88 @@
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+
+from benchmarks._ems import ems
+
+# Autograding throughput. One assignment gets --submissions Python programs that
+# count the primes below their input, some of them wrong and a few that never
+# finish, and is graded against a test spec once with a single worker process
+# and once with --workers; with CPU-bound tests the speedup should approach the
+# number of cores.
+#
+#   python -m benchmarks.autograde --submissions 1000 --workers 8
+
+CORRECT = '''n = int(input())
+sieve = [True] * n
+count = 0
+for i in range(2, n):
+    if sieve[i]:
+        count += 1
+        for j in range(i * i, n, i):
+            sieve[j] = False
+print(count)
+'''
+SLOW = '''n = int(input())
+print(sum(all(i % d for d in range(2, int(i ** 0.5) + 1)) for i in range(2, n)))
+'''
+WRONG = '''n = int(input())
+print(sum(1 for i in range(3, n, 2) if all(i % d for d in range(3, int(i ** 0.5) + 1, 2))))
+'''
+ENDLESS = '''while True:
+    pass
+'''
+TEST_SPEC = {'cases': [{'input': '5000', 'output': '669'}, {'input': '10000', 'output': '1229'},
+                       {'input': '100', 'output': '25'}]}
+
+
+def build_assignment(submissions, endless, seed=0):
+    rng = random.Random(seed)
+    ems.catalog.clear()
+    users = ems.UserDirectory()
+    doctor = ems.Doctor(users.next_user_id, 'doctor', 'password', 'Doctor', 'doctor@example.com')
+    users.add(doctor)
+    course = doctor.create_course('Course', 'C1')
+    assignment = course.add_assignment('Primes', 'Count the primes below n', '2026-12-01')
+    assignment.set_test_spec(TEST_SPEC)
+    for i in range(submissions):
+        student = ems.Student(users.next_user_id, f'student{i}', 'password', f'Student {i}', f'student{i}@example.com',
+                              hashed=True)
+        users.add(student)
+        student.register_course(course)
+        # A comment makes every body distinct, as real submissions are
+        content = ENDLESS if i < endless else rng.choice((CORRECT, CORRECT, SLOW, WRONG))
+        assignment.submit_solution(student, f'# Student {i}\n{content}')
+    return users, assignment
+
+
+def run(submissions, endless, workers, timeout):
+    users, assignment = build_assignment(submissions, endless)
+    graded, failed, seconds = ems.autograde(users, assignment, workers, timeout)
+    count, mean, _ = assignment.grade_stats()
+    return {'workers': workers, 'graded': graded, 'failed': failed, 'seconds': seconds,
+            'solutions_per_second': submissions / seconds, 'mean_grade': mean}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Measure autograding throughput with one and several processes.")
+    parser.add_argument('--submissions', type=int, default=1000, help="solutions to grade (default: 1000)")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help="grading processes (default: one per CPU)")
+    parser.add_argument('--endless', type=int, default=2, help="solutions that never finish (default: 2)")
+    parser.add_argument('--timeout', type=float, default=1, help="seconds per solution (default: 1)")
+    parser.add_argument('--autograde-user', metavar='ACCOUNT',
+                        help="run the solutions as this unprivileged user (default: unsandboxed, they are our own)")
+    args = parser.parse_args()
+    ems.sandbox_solutions(args.autograde_user, unsandboxed=args.autograde_user is None)
+
+    with tempfile.TemporaryDirectory() as directory:
+        ems.blobs.open(directory)
+        serial = run(args.submissions, args.endless, 1, args.timeout)
+        parallel = run(args.submissions, args.endless, args.workers, args.timeout)
+    result = {'submissions': args.submissions, 'cpus': os.cpu_count(), 'serial': serial, 'parallel': parallel,
+              'speedup': serial['seconds'] / parallel['seconds']}
+    print(f"{args.submissions} submissions: 1 worker {serial['seconds']:.1f}s, {args.workers} workers "
+          f"{parallel['seconds']:.1f}s, speedup {result['speedup']:.1f}x on {os.cpu_count()} CPUs", file=sys.stderr)
+    print(json.dumps(result))
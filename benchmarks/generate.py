@@ -0,0 +1,57 @@
+import random
+
+from benchmarks._ems import ems
+
+
+def generate_dataset(submissions, students_per_course=200, assignments_per_course=10, courses_per_student=5,
+                     content_size=200, distinct_contents=1000, seed=0):
+    # Build an in-memory dataset with roughly the requested number of submissions:
+    # every registered student submits every assignment of each of their courses.
+    per_course = students_per_course * assignments_per_course
+    courses = max(1, submissions // per_course)
+    return generate_users(doctors=max(1, courses // 4), courses=courses,
+                          students=max(students_per_course, courses * students_per_course // courses_per_student),
+                          assignments_per_course=assignments_per_course, students_per_course=students_per_course,
+                          content_size=content_size, distinct_contents=distinct_contents, seed=seed)
+
+
+def generate_users(doctors, courses, students, assignments_per_course=10, students_per_course=200, content_size=200,
+                   distinct_contents=1000, graded=0.8, seed=0):
+    # The dataset with explicit counts: courses are handed out to the doctors in
+    # turn, and each gets students_per_course random students who submit every
+    # assignment, a share of them graded. Bodies are drawn from distinct_contents
+    # variants (None: all different), the way copied starter code repeats; they
+    # go to the already opened ems.blobs.
+    rng = random.Random(seed)
+    ems.catalog.clear()
+    users = ems.UserDirectory()
+    password = ems.User.encrypt_password('password')
+
+    doctor_users = []
+    for i in range(doctors):
+        doctor = ems.Doctor(users.next_user_id, f'doctor{i}', password, f'Doctor {i}', f'doctor{i}@example.com', hashed=True)
+        users.add(doctor)
+        doctor_users.append(doctor)
+    student_users = []
+    for i in range(students):
+        student = ems.Student(users.next_user_id, f'student{i}', password, f'Student {i}', f'student{i}@example.com', hashed=True)
+        users.add(student)
+        student_users.append(student)
+
+    words = [''.join(rng.choice('abcdefghijklmnopqrstuvwxyz') for _ in range(rng.randint(2, 9))) for _ in range(500)]
+
+    def new_content():
+        return ' '.join(rng.choice(words) for _ in range(content_size // 6))[:content_size]
+
+    pool = None if distinct_contents is None else [new_content() for _ in range(distinct_contents)]
+    for c in range(courses):
+        course = doctor_users[c % doctors].create_course(f'Course {c}', f'C{c:05d}')
+        assignments = [course.add_assignment(f'Assignment {a}', f'Description of assignment {a}', f'2026-{a % 12 + 1:02d}-15')
+                       for a in range(assignments_per_course)]
+        for student in rng.sample(student_users, min(students_per_course, students)):
+            student.register_course(course)
+            for assignment in assignments:
+                assignment.submit_solution(student, new_content() if pool is None else rng.choice(pool))
+                if rng.random() < graded:
+                    assignment.grade_solution(student, str(rng.randint(40, 100)), None)
+    return users
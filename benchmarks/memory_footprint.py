@@ -0,0 +1,65 @@
+import argparse
+import hashlib
+import json
+import os
+import random
+import sys
+import tempfile
+import tracemalloc
+
+from benchmarks._ems import ems
+from benchmarks.generate import generate_dataset
+
+# Bytes per submission of the in-memory model. "dict" is the three-key dict
+# that used to hold each submission, "Solution" the slotted record that
+# replaced it; both reference strings built beforehand, so the difference is
+# the per-record overhead. The full model figure loads a generated JSON file,
+# whose bodies stay in the blob store.
+#
+#   python -m benchmarks.memory_footprint --submissions 100000
+
+
+def measure(build):
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = build()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return after - before, result
+
+
+def record_overhead(submissions):
+    rng = random.Random(0)
+    contents = [f'submission {i}' for i in range(submissions)]
+    grades = [rng.randint(0, 100) for _ in range(submissions)]
+    as_dicts, _ = measure(lambda: {i: {'content': contents[i], 'grade': grades[i], 'comments': None}
+                                   for i in range(submissions)})
+    digests = [hashlib.sha256(content.encode()).hexdigest() for content in contents]
+    as_records, _ = measure(lambda: {i: ems.Solution(digests[i], len(contents[i]), grades[i]) for i in range(submissions)})
+    return as_dicts / submissions, as_records / submissions
+
+
+def full_model(submissions, content_size):
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, 'ems_data.json')
+        ems.blobs.open(ems.blob_directory(filename))
+        ems.save_data(generate_dataset(submissions, content_size=content_size), filename)
+        ems.catalog.clear()
+        size, users = measure(lambda: ems.load_data(filename))
+        loaded = sum(len(assignment.solutions) for course in ems.catalog.courses.values()
+                     for assignment in course.assignments)
+        return size / loaded
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Report the memory cost of each submission.")
+    parser.add_argument('--submissions', type=int, default=100_000, help="number of submissions (default: 100000)")
+    parser.add_argument('--content-size', type=int, default=200, help="characters per submission (default: 200)")
+    args = parser.parse_args()
+    dict_bytes, record_bytes = record_overhead(args.submissions)
+    model_bytes = full_model(args.submissions, args.content_size)
+    print(f"record overhead: dict {dict_bytes:.0f} B, Solution {record_bytes:.0f} B per submission", file=sys.stderr)
+    print(f"full model from JSON: {model_bytes:.0f} B per submission "
+          f"({args.content_size}-character contents)", file=sys.stderr)
+    print(json.dumps({'submissions': args.submissions, 'dict_bytes_per_submission': dict_bytes,
+                      'solution_bytes_per_submission': record_bytes, 'model_bytes_per_submission': model_bytes}))
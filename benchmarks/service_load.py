@@ -0,0 +1,127 @@
+import argparse
+import asyncio
+import json
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks._ems import EMS_PATH
+
+# Load test of the service mode: a server is started on a fresh data file, then
+# every student connects, signs in and submits to the same assignment at once,
+# the way a class does right before a deadline. Spreading the students over
+# several courses (--courses) shows the per-course locks serving them in parallel.
+#
+#   python -m benchmarks.service_load --students 500 --submissions 10 --data ems_data.db
+
+
+class Client:
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+
+    @classmethod
+    async def connect(cls, address):
+        return cls(*await asyncio.open_unix_connection(address, limit=2 ** 24))
+
+    async def call(self, op, **fields):
+        self.writer.write(json.dumps({'op': op, **fields}).encode() + b'\n')
+        await self.writer.drain()
+        response = json.loads(await self.reader.readline())
+        if not response['ok']:
+            raise RuntimeError(f"{op}: {response['error']}")
+        return response['result']
+
+    async def close(self):
+        self.writer.close()
+        await self.writer.wait_closed()
+
+
+async def wait_for_server(address, process):
+    while not os.path.exists(address):
+        if process.poll() is not None:
+            raise RuntimeError("The server exited before it was ready.")
+        await asyncio.sleep(0.05)
+
+
+async def run(address, students, submissions, courses, content_size):
+    doctor = await Client.connect(address)
+    await doctor.call('sign_up', kind='doctor', username='doctor', password='secret', full_name='Doctor',
+                      email='doctor@example.com')
+    await doctor.call('sign_in', username='doctor', password='secret')
+    for c in range(courses):
+        await doctor.call('create_course', course_name=f'Course {c}', course_code=f'C{c}')
+        await doctor.call('add_assignment', course_code=f'C{c}', assignment_title='Final project',
+                          description='Due tonight', deadline='2026-12-01')
+
+    async def enroll(i):
+        client = await Client.connect(address)
+        await client.call('sign_up', kind='student', username=f'student{i}', password='secret',
+                          full_name=f'Student {i}', email=f'student{i}@example.com')
+        await client.call('sign_in', username=f'student{i}', password='secret')
+        await client.call('register_course', course_code=f'C{i % courses}')
+        return client
+
+    clients = await asyncio.gather(*(enroll(i) for i in range(students)))
+    content = 'x' * content_size
+    latencies = []
+
+    async def submit(i, client):
+        for _ in range(submissions):
+            start = time.perf_counter()
+            await client.call('submit_solution', course_code=f'C{i % courses}', assignment=1, content=content)
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(submit(i, client) for i, client in enumerate(clients)))
+    elapsed = time.perf_counter() - start
+
+    report = await doctor.call('assignment_grades', course_code='C0', assignment=1)
+    for client in clients + [doctor]:
+        await client.close()
+
+    latencies.sort()
+    return {
+        'students': students,
+        'courses': courses,
+        'requests': len(latencies),
+        'seconds': elapsed,
+        'requests_per_second': len(latencies) / elapsed,
+        'p50_ms': latencies[len(latencies) // 2] * 1000,
+        'p99_ms': latencies[min(len(latencies) - 1, len(latencies) * 99 // 100)] * 1000,
+        'solutions_in_c0': len(report['solutions']),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure submission throughput of the service mode.")
+    parser.add_argument('--students', type=int, default=200)
+    parser.add_argument('--submissions', type=int, default=5, help="submissions per student")
+    parser.add_argument('--courses', type=int, default=1, help="courses the students are spread over")
+    parser.add_argument('--content-size', type=int, default=200)
+    parser.add_argument('--data', default='ems_data.json', help="data file name, whose extension picks the backend")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        address = os.path.join(directory, 'ems.sock')
+        server = subprocess.Popen([sys.executable, EMS_PATH, '--data', os.path.join(directory, args.data),
+                                   '--serve', address], stdout=subprocess.DEVNULL)
+        try:
+            asyncio.run(wait_for_server(address, server))
+            result = asyncio.run(run(address, args.students, args.submissions, args.courses, args.content_size))
+        finally:
+            server.send_signal(signal.SIGINT)
+            server.wait()
+    result['data'] = args.data
+    json.dump(result, sys.stdout, indent=2)
+    print()
+    print(f"{result['requests']} submissions from {args.students} students in {result['seconds']:.2f}s: "
+          f"{result['requests_per_second']:.0f}/s, p50 {result['p50_ms']:.1f} ms, p99 {result['p99_ms']:.1f} ms",
+          file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+import argparse
+import itertools
+import json
+import random
+import sys
+import tempfile
+import time
+
+from benchmarks._ems import ems
+
+# Near-duplicate detection on one assignment. A share of the students hand in a
+# lightly edited copy of another student's work; the LSH index over MinHash
+# signatures is timed against comparing the shingle sets of every pair. Brute
+# force takes minutes at this size, so it is timed on a random sample of pairs
+# and scaled to all of them. Unrelated bodies share few shingles, so the exact
+# pairs the index is checked against are searched within each copied family.
+#
+#   python -m benchmarks.similarity --submissions 5000 --threshold 0.8
+
+
+def make_contents(submissions, content_size, copied, seed=0):
+    rng = random.Random(seed)
+    words = [''.join(rng.choice('abcdefghijklmnopqrstuvwxyz') for _ in range(rng.randint(2, 9))) for _ in range(2000)]
+    contents = []
+    families = []  # Index of the original each body was copied from, directly or not
+    for i in range(submissions):
+        if contents and rng.random() < copied:
+            # Copied work with a few words changed
+            source = rng.randrange(len(contents))
+            text = contents[source].split(' ')
+            for _ in range(max(1, len(text) // 40)):
+                text[rng.randrange(len(text))] = rng.choice(words)
+            contents.append(' '.join(text))
+            families.append(families[source])
+        else:
+            contents.append(' '.join(rng.choice(words) for _ in range(content_size // 6)))
+            families.append(i)
+    return contents, families
+
+
+def build_assignment(contents):
+    ems.catalog.clear()
+    users = ems.UserDirectory()
+    doctor = ems.Doctor(users.next_user_id, 'doctor', 'password', 'Doctor', 'doctor@example.com')
+    users.add(doctor)
+    course = doctor.create_course('Course', 'C1')
+    assignment = course.add_assignment('Assignment', 'Description', '2026-12-01')
+    for i, content in enumerate(contents):
+        student = ems.Student(users.next_user_id, f'student{i}', 'password', f'Student {i}', f'student{i}@example.com',
+                              hashed=True)
+        users.add(student)
+        student.register_course(course)
+        assignment.submit_solution(student, content)
+    return assignment
+
+
+def similar_pairs(shingle_sets, pairs, threshold):
+    found = set()
+    for (student_id, shingles), (other_id, other) in pairs:
+        common = len(shingles & other)
+        if common and common >= threshold * (len(shingles) + len(other) - common):
+            found.add((min(student_id, other_id), max(student_id, other_id)))
+    return found
+
+
+def brute_force_seconds(shingle_sets, threshold, sample, seed=0):
+    rng = random.Random(seed)
+    total = len(shingle_sets) * (len(shingle_sets) - 1) // 2
+    pairs = [tuple(rng.sample(shingle_sets, 2)) for _ in range(min(sample, total))]
+    start = time.perf_counter()
+    similar_pairs(shingle_sets, pairs, threshold)
+    return (time.perf_counter() - start) * total / len(pairs)
+
+
+def exact_pairs(shingle_sets, families, threshold):
+    members = {}
+    for entry, family in zip(shingle_sets, families):
+        members.setdefault(family, []).append(entry)
+    return similar_pairs(shingle_sets, itertools.chain.from_iterable(
+        itertools.combinations(family, 2) for family in members.values()), threshold)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compare LSH similar-solution search with brute force.")
+    parser.add_argument('--submissions', type=int, default=5000, help="solutions to the assignment (default: 5000)")
+    parser.add_argument('--content-size', type=int, default=600, help="characters per submission (default: 600)")
+    parser.add_argument('--copied', type=float, default=0.05, help="share of copied submissions (default: 0.05)")
+    parser.add_argument('--threshold', type=float, default=0.8, help="minimum similarity (default: 0.8)")
+    parser.add_argument('--sample', type=int, default=200_000, help="pairs brute force is timed on (default: 200000)")
+    args = parser.parse_args()
+
+    contents, families = make_contents(args.submissions, args.content_size, args.copied)
+    with tempfile.TemporaryDirectory() as directory:
+        ems.blobs.open(directory)
+        start = time.perf_counter()
+        assignment = build_assignment(contents)
+        submit_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        pairs = assignment.similar_solutions(args.threshold)
+        lsh_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        assignment.similar_solutions(args.threshold)
+        repeat_seconds = time.perf_counter() - start
+
+        shingle_sets = [(student_id, ems.shingles(assignment.get_solution_content(student_id)))
+                        for student_id in assignment.solutions]
+        brute_force = brute_force_seconds(shingle_sets, args.threshold, args.sample)
+        exact = exact_pairs(shingle_sets, families, args.threshold)
+
+    found = {(student_id, other_id) for _, student_id, other_id in pairs}
+    result = {
+        'submissions': args.submissions,
+        'threshold': args.threshold,
+        'submit_seconds': submit_seconds,
+        'lsh_seconds': lsh_seconds,
+        'lsh_repeat_seconds': repeat_seconds,
+        'brute_force_seconds': brute_force,
+        'exact_pairs': len(exact),
+        'lsh_pairs': len(found),
+        'recall': len(found & exact) / len(exact) if exact else 1.0,
+        'precision': len(found & exact) / len(found) if found else 1.0,
+    }
+    print(f"{args.submissions} submissions: LSH {lsh_seconds:.2f}s (then {repeat_seconds:.3f}s), "
+          f"brute force {brute_force:.0f}s (estimated), recall {result['recall']:.2f}, "
+          f"precision {result['precision']:.2f}", file=sys.stderr)
+    print(json.dumps(result))
@@ -0,0 +1,87 @@
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks._ems import ems
+from benchmarks.generate import generate_dataset
+
+# Cold start of the JSON and binary snapshot formats: each file is loaded in a
+# fresh interpreter so that load time and peak RSS are measured in isolation.
+#
+#   python -m benchmarks.snapshot_formats --scales 10000 100000 1000000
+
+FORMATS = {'json': 'ems_data.json', 'binary': 'ems_data.emsb'}
+
+
+def measure_load(filename):
+    start = time.perf_counter()
+    users = ems.load_data(filename)
+    elapsed = time.perf_counter() - start
+    # Assignments and submissions of the binary format load lazily, so only headers are counted
+    return {'seconds': elapsed, 'peak_rss_bytes': peak_rss(), 'users': len(users), 'courses': len(ems.catalog.courses)}
+
+
+def peak_rss():
+    # ru_maxrss survives fork+exec on Linux and would include the parent that
+    # generated the dataset, so prefer the per-process high-water mark.
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+
+
+def reset_peak_rss():
+    # Lowers the high-water mark to the current RSS, so the next peak_rss covers only what runs after it;
+    # False where the kernel does not allow it and the peak is the process's
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def run(scales, content_size):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    results = []
+    for scale in scales:
+        with tempfile.TemporaryDirectory() as directory:
+            # Both formats share the bodies in ems_data.blobs
+            ems.blobs.open(ems.blob_directory(os.path.join(directory, 'ems_data.json')))
+            users = generate_dataset(scale, content_size=content_size)
+            for name, basename in FORMATS.items():
+                filename = os.path.join(directory, basename)
+                ems.save_data(users, filename)
+                output = subprocess.run([sys.executable, '-m', 'benchmarks.snapshot_formats', '--load', filename],
+                                        cwd=root, check=True, capture_output=True, text=True).stdout
+                result = json.loads(output)
+                result.update({'scale': scale, 'format': name, 'file_bytes': os.path.getsize(filename)})
+                results.append(result)
+                print(f"{scale:>9} submissions  {name:<6}  load {result['seconds']:8.3f}s  "
+                      f"peak RSS {result['peak_rss_bytes'] / 2 ** 20:8.1f} MiB  file {result['file_bytes'] / 2 ** 20:8.1f} MiB",
+                      file=sys.stderr)
+            del users
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compare cold-start time and peak RSS of the snapshot formats.")
+    parser.add_argument('--scales', type=int, nargs='+', default=[10_000, 100_000, 1_000_000],
+                        help="numbers of submissions to generate (default: 10000 100000 1000000)")
+    parser.add_argument('--content-size', type=int, default=200, help="characters per submission (default: 200)")
+    parser.add_argument('--load', metavar='FILE', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.load:
+        print(json.dumps(measure_load(args.load)))
+    else:
+        print(json.dumps(run(args.scales, args.content_size), indent=2))
@@ -0,0 +1,174 @@
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks._ems import ems
+from benchmarks.generate import generate_users
+from benchmarks.snapshot_formats import peak_rss, reset_peak_rss
+
+# End-to-end scenarios on generated data. For every scale the dataset is built
+# with the given numbers of doctors, courses and students multiplied by the
+# scale, written through save_data in each format, and then measured in a fresh
+# interpreter per format:
+#
+#   startup            open_storage, which is what main() runs before the first menu
+#   sign_in            users.authenticate and a session token, as the sign-in menu does
+#   available_courses  storage.available_courses for a student
+#   view_grades        Student.view_grades
+#   grade_reports      storage.assignment_grades and grade_stats for an assignment
+#   save               save_data into a new file of the same format
+#
+# Each scenario reports its time and its own peak RSS: the high-water mark is
+# reset before it starts, which needs Linux's /proc/self/clear_refs. Elsewhere
+# the scenarios report no peak and only the whole run's peak RSS is compared.
+# --output saves the results, and --baseline compares a run with saved results
+# and exits with status 1 if any scenario got slower or bigger than --tolerance;
+# time changes under --noise seconds are ignored, as scheduling alone causes them.
+#
+#   python -m benchmarks.suite --scales 1 4 --output baseline.json
+#   python -m benchmarks.suite --scales 1 4 --baseline baseline.json
+
+FORMATS = {'json': 'ems_data.json', 'binary': 'ems_data.emsb', 'sqlite': 'ems_data.db'}
+SCENARIOS = ('startup', 'sign_in', 'available_courses', 'view_grades', 'grade_reports', 'save')
+
+
+def timed(results, name, operations, run):
+    reset = reset_peak_rss()
+    start = time.perf_counter()
+    for _ in range(operations):
+        run()
+    elapsed = time.perf_counter() - start
+    results[name] = {'seconds': elapsed, 'operations': operations, 'us_per_operation': elapsed / operations * 1e6,
+                     'peak_rss_bytes': peak_rss() if reset else None}
+
+
+def measure(filename, operations, seed=0):
+    # Runs in the fresh interpreter; operations pick random students and assignments
+    rng = random.Random(seed)
+    results = {}
+    timed(results, 'startup', 1, lambda: ems.open_storage(filename))
+    users = ems.storage.users
+    students = [user for user in users.values() if isinstance(user, ems.Student)]
+    courses = list(ems.catalog.courses.values())
+
+    def sign_in():
+        student = rng.choice(students)
+        ems.sessions.issue(users.authenticate(student.username, 'password'))
+
+    def grade_report():
+        course = rng.choice(courses)
+        assignment = rng.choice(course.assignments)
+        assignment.grade_stats()
+        list(ems.storage.assignment_grades(assignment))
+
+    timed(results, 'sign_in', operations, sign_in)
+    timed(results, 'available_courses', operations, lambda: ems.storage.available_courses(rng.choice(students)))
+    timed(results, 'view_grades', operations, lambda: rng.choice(students).view_grades())
+    timed(results, 'grade_reports', operations, grade_report)
+    root, extension = os.path.splitext(filename)
+    timed(results, 'save', 1, lambda: ems.save_data(users, f'{root}_saved{extension}'))
+    return results, peak_rss()
+
+
+def run(args):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    results = []
+    for scale in args.scales:
+        counts = {'doctors': max(1, round(args.doctors * scale)), 'courses': max(1, round(args.courses * scale)),
+                  'students': max(1, round(args.students * scale))}
+        with tempfile.TemporaryDirectory() as directory:
+            # Every format shares the bodies in ems_data.blobs
+            ems.blobs.open(ems.blob_directory(os.path.join(directory, 'ems_data.json')))
+            users = generate_users(**counts, assignments_per_course=args.assignments,
+                                   students_per_course=args.students_per_course, content_size=args.content_size)
+            submissions = sum(len(assignment.solutions) for course in ems.catalog.courses.values()
+                              for assignment in course.assignments)
+            for name in args.formats:
+                filename = os.path.join(directory, FORMATS[name])
+                ems.save_data(users, filename)
+                output = subprocess.run([sys.executable, '-m', 'benchmarks.suite', '--measure', filename,
+                                         '--operations', str(args.operations)],
+                                        cwd=root, check=True, capture_output=True, text=True).stdout
+                scenarios, run_peak = json.loads(output)
+                results.append({'scale': scale, 'format': name, **counts, 'submissions': submissions,
+                                'peak_rss_bytes': run_peak, 'scenarios': scenarios})
+                print(f"scale {scale:g} {name}: " + ", ".join(
+                    f"{scenario} {scenarios[scenario]['seconds']:.3f}s" for scenario in SCENARIOS) +
+                    f", peak RSS {run_peak / 2 ** 20:.1f} MiB", file=sys.stderr)
+            del users
+    return results
+
+
+def compare(results, baseline, tolerance, noise):
+    # Returns the regressions: (scale, format, scenario, metric, baseline value, current value). The
+    # scenarios are compared on time and peak RSS, plus a 'run' entry for the peak RSS of the whole run.
+    saved = {(entry['scale'], entry['format']): {**entry['scenarios'], 'run': entry} for entry in baseline}
+    regressions = []
+    for entry in results:
+        before = saved.get((entry['scale'], entry['format']))
+        if before is None:
+            continue
+        for scenario, current in {**entry['scenarios'], 'run': entry}.items():
+            if scenario not in before:
+                continue
+            for metric in ('seconds', 'peak_rss_bytes'):
+                if current.get(metric) is None or before[scenario].get(metric) is None:
+                    continue  # No per-scenario peak on this platform, or a baseline saved without a run peak
+                ratio = current[metric] / before[scenario][metric] if before[scenario][metric] else 1
+                regressed = ratio > 1 + tolerance and (metric != 'seconds' or
+                                                       current[metric] - before[scenario][metric] > noise)
+                print(f"scale {entry['scale']:g} {entry['format']:<6} {scenario:<17} {metric:<14} "
+                      f"{before[scenario][metric]:>14.4g} -> {current[metric]:>14.4g}  {ratio:6.2f}x"
+                      f"{'  REGRESSION' if regressed else ''}", file=sys.stderr)
+                if regressed:
+                    regressions.append((entry['scale'], entry['format'], scenario, metric,
+                                        before[scenario][metric], current[metric]))
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Time the main scenarios at several scales and catch regressions.")
+    parser.add_argument('--scales', type=float, nargs='+', default=[1, 4],
+                        help="multipliers for the numbers of doctors, courses and students (default: 1 4)")
+    parser.add_argument('--doctors', type=int, default=4, help="doctors at scale 1 (default: 4)")
+    parser.add_argument('--courses', type=int, default=40, help="courses at scale 1 (default: 40)")
+    parser.add_argument('--students', type=int, default=500, help="students at scale 1 (default: 500)")
+    parser.add_argument('--assignments', type=int, default=10, help="assignments per course (default: 10)")
+    parser.add_argument('--students-per-course', type=int, default=50, help="students in each course (default: 50)")
+    parser.add_argument('--content-size', type=int, default=200, help="characters per submission (default: 200)")
+    parser.add_argument('--formats', nargs='+', choices=FORMATS, default=list(FORMATS),
+                        help="data file formats to measure (default: all)")
+    parser.add_argument('--operations', type=int, default=200,
+                        help="operations timed in each query scenario (default: 200)")
+    parser.add_argument('--output', metavar='FILE', help="save the results as JSON, to be used as a baseline")
+    parser.add_argument('--baseline', metavar='FILE', help="compare with the results saved in FILE")
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help="allowed slowdown or growth over the baseline before it counts as a regression (default: 0.25)")
+    parser.add_argument('--noise', type=float, default=0.01,
+                        help="time differences in seconds too small to count as a regression (default: 0.01)")
+    parser.add_argument('--measure', metavar='FILE', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.measure:
+        print(json.dumps(measure(args.measure, args.operations)))
+        sys.exit()
+
+    config = {name: getattr(args, name) for name in ('doctors', 'courses', 'students', 'assignments',
+                                                      'students_per_course', 'content_size', 'operations')}
+    report = {'config': config, 'results': run(args)}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline['config'] != config:
+            print(f"warning: {args.baseline} was measured with {baseline['config']}", file=sys.stderr)
+        regressions = compare(report['results'], baseline['results'], args.tolerance, args.noise)
+        print(f"{len(regressions)} regressions over {args.tolerance:.0%}", file=sys.stderr)
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The tests load the application the way the benchmarks do, through benchmarks._ems
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
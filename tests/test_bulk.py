@@ -0,0 +1,38 @@
+import pytest
+
+from benchmarks._ems import ems
+
+BODY = '    x = 1\n\tprint(x)  \n\n'  # Indentation and trailing whitespace are part of the program
+
+
+@pytest.mark.parametrize('extension', ['.csv', '.jsonl'])
+def test_submissions_keep_their_whitespace_through_export_and_import(tmp_path, extension):
+    ems.catalog.clear()
+    ems.blobs.open(str(tmp_path / 'blobs'))
+    users = ems.UserDirectory()
+    doctor = ems.Doctor(users.next_user_id, 'doctor', 'password', 'Doctor', 'doctor@example.com')
+    users.add(doctor)
+    student = ems.Student(users.next_user_id, 'student', 'password', 'Student', 'student@example.com')
+    users.add(student)
+    course = doctor.create_course('Course', 'C1')
+    student.register_course(course)
+    assignment = course.add_assignment('Task', '  Indented\ndescription ', '2026-12-01')
+    assignment.submit_solution(student, BODY)
+    digest = assignment.solutions[student.user_id].digest
+
+    filename = str(tmp_path / f'submissions{extension}')
+    assert ems.export_file(users, 'submissions', filename) == 1
+    del assignment.solutions[student.user_id]
+    assert ems.import_file(users, 'submissions', filename) == (1, 0)
+
+    assert assignment.get_solution_content(student.user_id) == BODY
+    assert assignment.solutions[student.user_id].digest == digest
+
+
+def test_key_fields_are_still_stripped(tmp_path):
+    ems.catalog.clear()
+    users = ems.UserDirectory()
+    filename = tmp_path / 'users.csv'
+    filename.write_text('kind,username,password,full_name,email\n Student , ann ,pw,Ann, ann@example.com \n')
+    assert ems.import_file(users, 'users', str(filename)) == (1, 0)
+    assert users.find_by_username('ann').email == 'ann@example.com'
@@ -0,0 +1,65 @@
+import os
+
+import pytest
+
+from benchmarks._ems import ems
+
+
+def run_session(filename, change):
+    # One run of the program that ends without a compaction, as after a crash
+    users = ems.open_storage(filename)
+    change(users)
+    ems.storage.sync()
+    ems.close_storage()
+
+
+def add_doctor(users):
+    users.add(ems.Doctor(users.next_user_id, 'doctor', 'password', 'Doctor', 'doctor@example.com'))
+
+
+def add_course_and_student(users):
+    users.find_by_username('doctor').create_course('Course', 'C1')
+    users.add(ems.Student(users.next_user_id, 'student', 'password', 'Student', 'student@example.com'))
+
+
+@pytest.mark.parametrize('data_file', ['ems_data.json', 'ems_data.emsb'])
+@pytest.mark.parametrize('torn_tail', [b'{"seq": 2, "op": "sign_', b'{"seq": 2, "op": "noop"}'])
+def test_records_after_a_torn_tail_survive(tmp_path, data_file, torn_tail):
+    filename = str(tmp_path / data_file)
+    run_session(filename, add_doctor)
+    with open(ems.journal_filename(filename), 'ab') as f:
+        f.write(torn_tail)  # Cut off by a crash before its newline
+
+    run_session(filename, add_course_and_student)
+
+    users = ems.load_data(filename)
+    assert ems.catalog.get('C1') is not None
+    assert users.find_by_username('student') is not None
+    with open(ems.journal_filename(filename), 'rb') as f:
+        assert torn_tail not in f.read()
+
+
+def test_json_and_binary_files_side_by_side_keep_their_own_journals(tmp_path):
+    json_file, binary_file = str(tmp_path / 'ems_data.json'), str(tmp_path / 'ems_data.emsb')
+    run_session(json_file, add_doctor)
+    ems.migrate_data(json_file, binary_file)
+    run_session(binary_file, add_course_and_student)
+
+    users = ems.load_data(json_file)
+    assert ems.catalog.get('C1') is None
+    assert users.find_by_username('student') is None
+    ems.storage_for(json_file).compact(users)
+
+    users = ems.load_data(binary_file)
+    assert ems.catalog.get('C1') is not None
+    assert users.find_by_username('student') is not None
+
+
+def test_a_journal_under_the_old_name_is_replayed(tmp_path):
+    filename = str(tmp_path / 'ems_data.json')
+    run_session(filename, add_doctor)
+    os.replace(ems.journal_filename(filename), str(tmp_path / 'ems_data.journal'))
+
+    users = ems.load_data(filename)
+    assert users.find_by_username('doctor') is not None
+    assert os.path.exists(ems.journal_filename(filename))
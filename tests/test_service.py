@@ -0,0 +1,18 @@
+import asyncio
+import json
+
+from benchmarks._ems import ems
+
+
+def test_a_server_failure_is_answered_with_an_error(monkeypatch, capsys):
+    def disk_full(self, session, request):
+        raise OSError(28, 'No space left on device')
+
+    monkeypatch.setattr(ems.Service, 'op_list_courses', disk_full)
+    service = ems.Service(ems.UserDirectory())
+    response = asyncio.run(service.dispatch({'token': None}, json.dumps({'op': 'list_courses', 'id': 7})))
+
+    assert response['ok'] is False
+    assert 'OSError' in response['error']
+    assert response['id'] == 7
+    assert 'No space left on device' in capsys.readouterr().err